@@ -1,4 +1,3 @@
-import asyncio
 import logging
 from typing import Dict
 
@@ -19,9 +18,13 @@ from .types import (
     HotWaterSystem,
 )
 
-from .monitor import Monitor
+from .cache import NegativeCache, ParameterCache
+from .limiter import Throttle, TokenBucket
+from .monitor import CallbackQueue, Monitor
+from .retry import RetryBudget, RetryPolicy
 from .uplink import Uplink
 from .session import UplinkSession
+from .thermostat import ThermostatPublisher
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -31,21 +34,26 @@ async def get_active_climate(
 ) -> Dict[str, ClimateSystem]:
     active = {}
 
-    async def check(key: str, value: ClimateSystem):
+    parameters = await uplink.get_parameters(
+        system_id,
+        [
+            value.active_accessory
+            for value in PARAM_CLIMATE_SYSTEMS.values()
+            if value.active_accessory is not None
+        ],
+    )
+
+    for key, value in PARAM_CLIMATE_SYSTEMS.items():
         if value.active_accessory is None:
             active[key] = value
-            return
+            continue
 
-        available = await uplink.get_parameter(system_id, value.active_accessory)
+        available = parameters.get(value.active_accessory)
 
         _LOGGER.debug("Climate %s:%s active_accessory: %s", system_id, key, available)
         if available and available["rawValue"] == 1:
             active[key] = value
 
-    await asyncio.gather(
-        *[check(key, value) for key, value in PARAM_CLIMATE_SYSTEMS.items()]
-    )
-
     return active
 
 
@@ -54,12 +62,21 @@ async def get_active_hotwater(
 ) -> Dict[str, HotWaterSystem]:
     active = {}
 
-    async def check(key: str, value: HotWaterSystem):
+    parameters = await uplink.get_parameters(
+        system_id,
+        [
+            value.hot_water_production
+            for value in PARAM_HOTWATER_SYSTEMS.values()
+            if value.hot_water_production is not None
+        ],
+    )
+
+    for key, value in PARAM_HOTWATER_SYSTEMS.items():
         if value.hot_water_production is None:
             active[key] = value
-            return
+            continue
 
-        available = await uplink.get_parameter(system_id, value.hot_water_production)
+        available = parameters.get(value.hot_water_production)
 
         _LOGGER.debug(
             "Hotwater %s:%s hot_water_production: %s", system_id, key, available
@@ -67,10 +84,6 @@ async def get_active_hotwater(
         if available and available["rawValue"] == 1:
             active[key] = value
 
-    await asyncio.gather(
-        *[check(key, value) for key, value in PARAM_HOTWATER_SYSTEMS.items()]
-    )
-
     return active
 
 
@@ -79,18 +92,23 @@ async def get_active_ventilations(
 ) -> Dict[str, VentilationSystem]:
     active = {}
 
-    async def check(key: str, value: VentilationSystem):
+    parameters = await uplink.get_parameters(
+        system_id,
+        [
+            value.fan_speed
+            for value in PARAM_VENTILATION_SYSTEMS.values()
+            if value.fan_speed is not None
+        ],
+    )
+
+    for key, value in PARAM_VENTILATION_SYSTEMS.items():
         if value.fan_speed is None:
-            return
+            continue
 
-        available = await uplink.get_parameter(system_id, value.fan_speed)
+        available = parameters.get(value.fan_speed)
 
         _LOGGER.debug("Ventilation %s:%s fan_speed: %s", system_id, key, available)
         if available and available["rawValue"] != -32768:
             active[key] = value
 
-    await asyncio.gather(
-        *[check(key, value) for key, value in PARAM_VENTILATION_SYSTEMS.items()]
-    )
-
     return active
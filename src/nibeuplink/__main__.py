@@ -99,9 +99,7 @@ async def run():
         else:
 
             if args.parameter:
-                todo.extend(
-                    [uplink.get_parameter(args.system, p) for p in args.parameter]
-                )
+                todo.extend([uplink.get_parameters(args.system, args.parameter)])
 
             if args.categories:
                 todo.extend([uplink.get_categories(args.system, False, args.unit)])
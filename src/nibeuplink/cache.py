@@ -0,0 +1,137 @@
+"""Caching of parameter values."""
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+from .typing import ParameterId, ParameterType, SystemId
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class ParameterCache:
+    """
+    Least recently used cache of parameter values.
+
+    Values are fresh for `ttl` seconds after being stored, which can
+    be overridden per parameter using `ttls`. After that they are
+    considered stale for another `stale` seconds, during which they
+    are still returned but should be refreshed by the caller.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 30.0,
+        stale: float = 300.0,
+        maxsize: int = 1024,
+        ttls: Optional[Dict[ParameterId, float]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._ttl = ttl
+        self._stale = stale
+        self._maxsize = maxsize
+        self._ttls = {str(key): value for key, value in (ttls or {}).items()}
+        self._clock = clock
+        self._entries = (
+            OrderedDict()
+        )  # type: OrderedDict[Tuple[SystemId, str], Tuple[float, ParameterType]]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_ttl(self, parameter_id: ParameterId, ttl: float):
+        self._ttls[str(parameter_id)] = ttl
+
+    def set(self, system_id: SystemId, parameter_id: ParameterId, data: ParameterType):
+        key = (system_id, str(parameter_id))
+        self._entries[key] = (self._clock(), data)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, system_id: SystemId, parameter_id: ParameterId):
+        self._entries.pop((system_id, str(parameter_id)), None)
+
+    def lookup(
+        self, system_id: SystemId, parameter_id: ParameterId
+    ) -> Tuple[Optional[ParameterType], bool]:
+        """Get cached value and whether it is still fresh."""
+        key = (system_id, str(parameter_id))
+        entry = self._entries.get(key)
+        if entry is None:
+            return None, False
+
+        timestamp, data = entry
+        age = self._clock() - timestamp
+        ttl = self._ttls.get(key[1], self._ttl)
+        if age > ttl + self._stale:
+            del self._entries[key]
+            return None, False
+
+        self._entries.move_to_end(key)
+        return data, age <= ttl
+
+    def clear(self):
+        self._entries.clear()
+
+
+class NegativeCache:
+    """
+    Tracking of parameters the API does not return.
+
+    Parameters missing from `threshold` consecutive responses for a
+    system are excluded from requests for `period` seconds. Once the
+    period has passed, they are probed again, and excluded again for
+    a new period if still missing.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 3,
+        period: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._threshold = threshold
+        self._period = period
+        self._clock = clock
+        self._counts = {}  # type: Dict[Tuple[SystemId, str], int]
+        self._excluded = {}  # type: Dict[Tuple[SystemId, str], float]
+
+    def __len__(self):
+        return len(self._excluded)
+
+    def missing(self, system_id: SystemId, parameter_id: ParameterId):
+        key = (system_id, str(parameter_id))
+        count = self._counts.get(key, 0) + 1
+        self._counts[key] = count
+        if count >= self._threshold:
+            _LOGGER.debug(
+                "Excluding parameter %s on system %s for %s seconds",
+                parameter_id,
+                system_id,
+                self._period,
+            )
+            self._excluded[key] = self._clock() + self._period
+
+    def found(self, system_id: SystemId, parameter_id: ParameterId):
+        key = (system_id, str(parameter_id))
+        self._counts.pop(key, None)
+        self._excluded.pop(key, None)
+
+    def excluded(self, system_id: SystemId, parameter_id: ParameterId) -> bool:
+        key = (system_id, str(parameter_id))
+        until = self._excluded.get(key)
+        if until is None:
+            return False
+
+        if self._clock() < until:
+            return True
+
+        # let a single probe through, a new miss excludes it again
+        del self._excluded[key]
+        self._counts[key] = self._threshold - 1
+        return False
+
+    def clear(self):
+        self._counts.clear()
+        self._excluded.clear()
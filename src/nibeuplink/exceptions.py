@@ -54,6 +54,11 @@ ERROR_CODES = {
     32: ("REGISTRATION_UNAVAILABLE", "Registration is unavailable."),
 }
 
+ERROR_NO_METADATA = 17
+ERROR_UNKNOWN_PARAMETER = 18
+ERROR_SYSTEM_OFFLINE = 26
+ERROR_RATE_LIMIT = 28
+
 
 class UplinkException(Exception):
     pass
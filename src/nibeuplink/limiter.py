@@ -0,0 +1,176 @@
+"""Rate limiting of requests to API."""
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional
+
+import aiohttp
+
+from .exceptions import ERROR_RATE_LIMIT, UplinkResponseException
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def is_rate_limited(exc: BaseException) -> bool:
+    """Check if exception was caused by a rate limited request."""
+    if isinstance(exc, UplinkResponseException) and exc.code == ERROR_RATE_LIMIT:
+        return True
+    cause = exc.__cause__
+    return isinstance(cause, aiohttp.ClientResponseError) and cause.status == 429
+
+
+def get_retry_after(exc: BaseException) -> Optional[float]:
+    """Get the delay in seconds requested by a Retry-After header, if any."""
+    cause = exc.__cause__
+    if not isinstance(cause, aiohttp.ClientResponseError) or not cause.headers:
+        return None
+
+    value = cause.headers.get("Retry-After")
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        _LOGGER.debug("Ignoring invalid Retry-After header %s", value)
+        return None
+    if date.tzinfo is None:
+        # dates in the -0000 zone are parsed as naive, but are in utc
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class Throttle:
+    """
+    Throttling requests to API.
+
+    Works by awaiting our turn then executing the request,
+    and scheduling next request at a delay after the previous
+    request completed. With `from_start` set, next request is
+    instead scheduled at a delay after the previous request
+    started.
+    """
+
+    def __init__(self, delay, from_start: bool = False):
+        self._delay = delay
+        self._from_start = from_start
+        self._timestamp = datetime.now()
+
+    async def __aenter__(self):
+        timestamp = datetime.now()
+        delay = (self._timestamp - timestamp).total_seconds()
+        if delay > 0:
+            _LOGGER.debug("Delaying request by %s seconds due to throttle", delay)
+            await asyncio.sleep(delay)
+        if self._from_start:
+            self._timestamp = datetime.now() + self._delay
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if not self._from_start:
+            self._timestamp = datetime.now() + self._delay
+
+
+class TokenBucket:
+    """
+    Token bucket limiting of requests to API.
+
+    Tokens are refilled at `rate` per second up to `burst` tokens,
+    and every request consumes one. Requests arriving at an empty
+    bucket reserve a future token and sleep until it is available,
+    so concurrent requests are spaced out in arrival order.
+
+    When a request is rejected due to rate limiting, the rate is
+    divided by `backoff` (down to `min_rate`) and the bucket is
+    drained, honoring any Retry-After given by the server. Every
+    successful request then adds `recovery` times the configured
+    rate back, until the configured rate is reached again.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        clock: Callable[[], float] = time.monotonic,
+        backoff: float = 2.0,
+        recovery: float = 0.05,
+        min_rate: Optional[float] = None,
+    ):
+        self._limit = rate
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._backoff = backoff
+        self._recovery = recovery
+        self._min_rate = rate / 16 if min_rate is None else min_rate
+        self._tokens = float(burst)
+        self._timestamp = clock()
+
+    def _refill(self):
+        now = self._clock()
+        if math.isinf(self._rate):
+            self._tokens = float(self._burst)
+        else:
+            self._tokens = min(
+                float(self._burst),
+                self._tokens + (now - self._timestamp) * self._rate,
+            )
+        self._timestamp = now
+
+    async def acquire(self):
+        self._refill()
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return
+
+        delay = -self._tokens / self._rate
+        _LOGGER.debug("Delaying request by %s seconds due to throttle", delay)
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            self._tokens += 1
+            raise
+
+    @property
+    def rate(self) -> float:
+        """Currently allowed rate in requests per second."""
+        return self._rate
+
+    def decrease(self, retry_after: Optional[float] = None):
+        if math.isinf(self._rate):
+            return
+
+        self._refill()
+        self._rate = max(self._min_rate, self._rate / self._backoff)
+        self._tokens = min(self._tokens, 0.0)
+        if retry_after:
+            self._tokens -= retry_after * self._rate
+        _LOGGER.warning(
+            "Rate limited by server, reducing rate to %s requests per second",
+            self._rate,
+        )
+
+    def increase(self):
+        if self._rate >= self._limit:
+            return
+
+        self._refill()
+        self._rate = min(self._limit, self._rate + self._limit * self._recovery)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if exc_val is None:
+            self.increase()
+        elif is_rate_limited(exc_val):
+            self.decrease(get_retry_after(exc_val))
@@ -1,56 +1,495 @@
 """Helpers to monitor state."""
 import asyncio
+import heapq
+import itertools
 import logging
-from collections import OrderedDict
-from typing import Callable, Dict, Tuple, List
+import time
+from collections import deque
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Mapping,
+    Tuple,
+    List,
+    Optional,
+    Union,
+    cast,
+)
+from typing_extensions import Deque
 
 from .const import MAX_REQUEST_PARAMETERS
-from .utils import cyclic_tuple
+from .scheduler import PRIORITY_BACKGROUND
 from .typing import ParameterSet, SystemId, ParameterId, Parameter
 from .uplink import Uplink
 
 _LOGGER = logging.getLogger(__name__)
 
 Callback = Callable[[SystemId, ParameterSet], None]
+AsyncCallback = Callable[[SystemId, ParameterSet], Awaitable[None]]
+AnyCallback = Union[Callback, AsyncCallback]
+Key = Tuple[SystemId, ParameterId]
+
+# callback and whether it is in delta mode
+Subscription = Tuple[AnyCallback, bool]
+
+# scope of subscriptions, with None matching any system or parameter
+Scope = Tuple[Optional[SystemId], Optional[ParameterId]]
+
+# heap entries of due time, insertion order and parameter id
+Entry = Tuple[float, int, ParameterId]
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_COALESCE = "coalesce"
+OVERFLOW_BLOCK = "block"
+
+
+class CallbackQueue:
+    """
+    Bounded queue in front of an async callback.
+
+    The callback is run from a task of its own, so that a slow
+    callback does not hold up polling. When the queue is full,
+    `overflow` decides what happens to new parameters. With
+    OVERFLOW_DROP_OLDEST the oldest queued set is dropped. With
+    OVERFLOW_COALESCE the parameters are merged into the last set
+    queued for the same system, or the oldest set is dropped if
+    there is none. With OVERFLOW_BLOCK, `put` waits for room, while
+    `put_nowait` lets the queue grow beyond `maxsize` as it has no
+    way to wait. Once closed, parameters put are dropped.
+    """
+
+    def __init__(
+        self,
+        callback: AsyncCallback,
+        maxsize: int = 100,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE, OVERFLOW_BLOCK):
+            raise ValueError("Unknown overflow policy {}".format(overflow))
+        self._callback = callback
+        self._maxsize = maxsize
+        self._overflow = overflow
+        self._clock = clock
+        self._queue = deque()  # type: Deque[Tuple[SystemId, ParameterSet, float]]
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._task = None  # type: Optional[asyncio.Future]
+        self._closed = False
+        self.dropped = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of parameter sets waiting for the callback."""
+        return len(self._queue)
+
+    @property
+    def lag(self) -> float:
+        """Seconds the oldest queued parameter set has been waiting."""
+        if not self._queue:
+            return 0.0
+        return self._clock() - self._queue[0][2]
+
+    def _coalesce(self, system_id: SystemId, parameter_set: ParameterSet) -> bool:
+        for queued in reversed(self._queue):
+            if queued[0] == system_id:
+                queued[1].update(parameter_set)
+                self.coalesced += 1
+                return True
+        return False
+
+    async def put(self, system_id: SystemId, parameter_set: ParameterSet):
+        if self._overflow == OVERFLOW_BLOCK:
+            while not self._closed and len(self._queue) >= self._maxsize:
+                self._not_full.clear()
+                await self._not_full.wait()
+
+        self.put_nowait(system_id, parameter_set)
+
+    def put_nowait(self, system_id: SystemId, parameter_set: ParameterSet):
+        if self._closed:
+            return
+
+        if len(self._queue) >= self._maxsize and self._overflow != OVERFLOW_BLOCK:
+            if self._overflow == OVERFLOW_COALESCE and self._coalesce(
+                system_id, parameter_set
+            ):
+                return
+            self._queue.popleft()
+            self.dropped += 1
+            _LOGGER.debug("Dropped parameters due to full callback queue")
+
+        self._queue.append((system_id, parameter_set, self._clock()))
+        self._not_empty.set()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+
+            system_id, parameter_set, _ = self._queue.popleft()
+            self._not_full.set()
+            try:
+                await self._callback(system_id, parameter_set)
+            except Exception:
+                _LOGGER.exception("Error in callback for system %s", system_id)
+
+    def close(self):
+        """Stop calling the callback, dropping anything queued."""
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._queue.clear()
+        self._not_full.set()
 
 
 class Monitor:
-    def __init__(self, uplink: Uplink, chunks: int = MAX_REQUEST_PARAMETERS):
+    """
+    Poll subscribed parameters and pass them on to callbacks.
+
+    Each subscription has a poll interval, and parameters are
+    requested when they are due. Every request is filled up with
+    the most overdue parameters of a system, followed by those
+    that are due the soonest. With all intervals at zero,
+    parameters are polled round robin.
+
+    Callbacks can be scoped to a system and to a set of parameters,
+    and are only given the parameters within their scope. Async
+    callbacks are run behind a `CallbackQueue` each. Callbacks
+    added in delta mode are only given parameters whose raw value
+    changed by more than their deadband since last delivered, or
+    that have not been delivered for `refresh` seconds.
+    """
+
+    def __init__(
+        self,
+        uplink: Uplink,
+        chunks: int = MAX_REQUEST_PARAMETERS,
+        delay: float = 4.5,
+        refresh: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
         self._uplink = uplink
-        self._callbacks = []  # type: List[Callback]
-        self._parameters = (
-            OrderedDict()
-        )  # type: Dict[Tuple[SystemId, ParameterId], int]
-        self._iterator = cyclic_tuple(self._parameters.keys(), chunks)
+        self._chunks = chunks
+        self._delay = delay
+        self._clock = clock
+        self._refresh = refresh
+        self._index = {}  # type: Dict[Scope, List[Subscription]]
+        self._scopes = {}  # type: Dict[AnyCallback, List[Scope]]
+        self._queues = {}  # type: Dict[AnyCallback, CallbackQueue]
+        self._delivered = (
+            {}
+        )  # type: Dict[Subscription, Dict[Key, Tuple[Any, float]]]
+        self._deadbands = {}  # type: Dict[Key, float]
+        self._parameters = {}  # type: Dict[Key, List[float]]
+        self._entries = {}  # type: Dict[Key, Entry]
+        self._heaps = {}  # type: Dict[SystemId, List[Entry]]
+        self._heads = {}  # type: Dict[SystemId, Entry]
+        self._systems = []  # type: List[Tuple[Entry, SystemId]]
+        self._counter = itertools.count()
+        self._wakeup = None  # type: Optional[asyncio.Event]
+        self._wake_at = None  # type: Optional[float]
+
+    def add_callback(
+        self,
+        callback: AnyCallback,
+        delta: bool = False,
+        system_id: Optional[SystemId] = None,
+        parameter_ids: Optional[Iterable[ParameterId]] = None,
+        maxsize: int = 100,
+        overflow: str = OVERFLOW_DROP_OLDEST,
+    ):
+        """Add callback for parameters of a system, or of all systems.
 
-        # start iterator up, empty list will yield empty
-        next(self._iterator)
+        Async callbacks are queued, see `CallbackQueue` for `maxsize`
+        and `overflow`.
+        """
+        if asyncio.iscoroutinefunction(callback) and callback not in self._queues:
+            self._queues[callback] = CallbackQueue(
+                cast(AsyncCallback, callback), maxsize, overflow, self._clock
+            )
+
+        if parameter_ids is None:
+            scopes = [(system_id, None)]  # type: List[Scope]
+        else:
+            scopes = [(system_id, parameter_id) for parameter_id in parameter_ids]
 
-    def add_callback(self, callback):
-        self._callbacks.append(callback)
+        subscription = (callback, delta)
+        for scope in scopes:
+            self._index.setdefault(scope, []).append(subscription)
+        self._scopes.setdefault(callback, []).extend(scopes)
 
-    def del_callback(self, callback):
-        self._callbacks.remove(callback)
+        if delta:
+            # values last delivered are tracked per subscription, so a
+            # new callback gets all values without resending to others
+            self._delivered.setdefault(subscription, {})
 
-    def add(self, system_id: SystemId, parameter_id: ParameterId):
+    def del_callback(self, callback: AnyCallback):
+        if callback not in self._scopes:
+            raise ValueError("Callback {} not added".format(callback))
+
+        queue = self._queues.pop(callback, None)
+        if queue:
+            queue.close()
+        self._delivered.pop((callback, True), None)
+
+        for scope in self._scopes.pop(callback):
+            subscriptions = self._index[scope]
+            for subscription in subscriptions:
+                if subscription[0] == callback:
+                    break
+            subscriptions.remove(subscription)
+            if not subscriptions:
+                del self._index[scope]
+
+    def close(self):
+        """Stop the tasks running async callbacks."""
+        for queue in self._queues.values():
+            queue.close()
+
+    def get_queue(self, callback: AsyncCallback) -> Optional[CallbackQueue]:
+        """Get queue of an async callback, to inspect its depth and lag."""
+        return self._queues.get(callback)
+
+    def set_deadband(
+        self, system_id: SystemId, parameter_id: ParameterId, deadband: float
+    ):
+        """Ignore changes of raw value up to `deadband` in delta mode."""
+        self._deadbands[(system_id, parameter_id)] = deadband
+
+    def add(
+        self, system_id: SystemId, parameter_id: ParameterId, interval: float = 0.0
+    ):
+        """Subscribe to a parameter, polling it every `interval` seconds."""
         key = (system_id, parameter_id)
-        if key in self._parameters:
-            self._parameters[key] += 1
-        else:
-            self._parameters[key] = 1
+        intervals = self._parameters.setdefault(key, [])
+        intervals.append(interval)
+
+        # new parameters are due at once, shorter intervals may make
+        # existing parameters due earlier
+        now = self._clock()
+        entry = self._entries.get(key)
+        if entry is None:
+            self._schedule(key, now)
+        elif now + interval < entry[0]:
+            self._schedule(key, now + interval)
 
-    def remove(self, system_id: SystemId, parameter_id: ParameterId):
+    def remove(
+        self,
+        system_id: SystemId,
+        parameter_id: ParameterId,
+        interval: Optional[float] = None,
+    ):
         key = (system_id, parameter_id)
-        self._parameters[key] -= 1
-        if not self._parameters[key]:
+        intervals = self._parameters[key]
+        if interval is None:
+            intervals.pop()
+        else:
+            intervals.remove(interval)
+        if not intervals:
             del self._parameters[key]
+            del self._entries[key]
+            self._deadbands.pop(key, None)
+            for delivered in self._delivered.values():
+                delivered.pop(key, None)
+
+    def postpone(
+        self,
+        system_id: SystemId,
+        parameters: Union[ParameterSet, Iterable[ParameterId]],
+    ):
+        """Delay next poll of parameters, when their values are known anyway.
+
+        Parameters are given by id, or as a `ParameterSet` like the one
+        given to callbacks, matched by both name and parameter id.
+        """
+        if isinstance(parameters, Mapping):
+            parameter_ids = {}  # type: Dict[ParameterId, None]
+            for name, parameter in parameters.items():
+                parameter_ids[name] = None
+                if parameter and "parameterId" in parameter:
+                    parameter_ids[parameter["parameterId"]] = None
+        else:
+            parameter_ids = dict.fromkeys(parameters)
+
+        now = self._clock()
+        for parameter_id in parameter_ids:
+            key = (system_id, parameter_id)
+            if key in self._parameters:
+                self._schedule(key, now + self._interval(key))
+
+    def _interval(self, key: Key) -> float:
+        return min(self._parameters[key])
+
+    def _schedule(self, key: Key, due: float):
+        # replaced entries are left in the heap, and skipped when popped
+        entry = (due, next(self._counter), key[1])
+        self._entries[key] = entry
+        heapq.heappush(self._heaps.setdefault(key[0], []), entry)
+
+        head = self._heads.get(key[0])
+        if head is None or entry < head:
+            self._set_head(key[0], entry)
+
+        # wake up run if the parameter is due before it would
+        if self._wakeup and (self._wake_at is None or due < self._wake_at):
+            self._wakeup.set()
+
+    def _valid(self, system_id: SystemId, entry: Entry) -> bool:
+        return self._entries.get((system_id, entry[2])) is entry
+
+    def _top(self, system_id: SystemId) -> Optional[Entry]:
+        heap = self._heaps.get(system_id, [])
+        while heap:
+            entry = heap[0]
+            if self._valid(system_id, entry):
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def _set_head(self, system_id: SystemId, entry: Entry):
+        # systems are kept in a heap of their first entry, replaced
+        # heads are left in the heap, and skipped when found on top
+        self._heads[system_id] = entry
+        heapq.heappush(self._systems, (entry, system_id))
+
+    def _next(self) -> Tuple[Optional[SystemId], Optional[Entry]]:
+        """Find the system with the most overdue parameter."""
+        while self._systems:
+            entry, system_id = self._systems[0]
+            if self._heads.get(system_id) is not entry:
+                heapq.heappop(self._systems)
+                continue
+
+            if self._valid(system_id, entry):
+                return system_id, entry
+
+            # head was polled, rescheduled or removed, so find the new one
+            heapq.heappop(self._systems)
+            del self._heads[system_id]
+            top = self._top(system_id)
+            if top is None:
+                self._heaps.pop(system_id, None)
+            else:
+                self._set_head(system_id, top)
+        return None, None
+
+    def next_due(self) -> Optional[float]:
+        """Get time when the next parameter is due, if any."""
+        _, entry = self._next()
+        return entry[0] if entry else None
+
+    def _pop_due(self) -> Tuple[Optional[SystemId], List[ParameterId]]:
+        now = self._clock()
+        system_id, entry = self._next()
+        if system_id is None or entry is None or entry[0] > now:
+            return None, []
 
-    def postpone(self, system_id: SystemId, parameters: ParameterSet):
-        self._iterator.send((system_id, parameters))
+        parameter_ids = []  # type: List[ParameterId]
+        while len(parameter_ids) < self._chunks:
+            entry = self._top(system_id)
+            if entry is None:
+                break
+            heapq.heappop(self._heaps[system_id])
+            parameter_ids.append(entry[2])
+
+        for parameter_id in parameter_ids:
+            key = (system_id, parameter_id)
+            self._schedule(key, now + self._interval(key))
+
+        return system_id, parameter_ids
+
+    def _changed(
+        self,
+        delivered: Dict[Key, Tuple[Any, float]],
+        key: Key,
+        value: Any,
+        now: float,
+    ) -> bool:
+        """Check if value changed since delivered, and if so mark it delivered."""
+        previous = delivered.get(key)
+        if previous is not None:
+            previous_value, timestamp = previous
+            deadband = self._deadbands.get(key, 0.0)
+            if self._refresh and now - timestamp >= self._refresh:
+                pass
+            elif isinstance(value, (int, float)) and isinstance(
+                previous_value, (int, float)
+            ):
+                if abs(value - previous_value) <= deadband:
+                    return False
+            elif value == previous_value:
+                return False
+
+        # values within deadband are compared to the one delivered,
+        # so that slow drift is delivered eventually
+        delivered[key] = (value, now)
+        return True
+
+    def _route(
+        self, system_id: SystemId, parameters: Dict[ParameterId, Parameter]
+    ) -> Dict[Subscription, ParameterSet]:
+        """Get parameter sets to deliver, by subscription."""
+        found = {}  # type: Dict[ParameterId, Parameter]
+        for parameter_id, parameter in parameters.items():
+            if parameter:
+                found[parameter_id] = parameter
+            else:
+                _LOGGER.debug(
+                    "Parameter %s not found for system %s", parameter_id, system_id
+                )
+
+        now = self._clock()
+        deliveries = {}  # type: Dict[Subscription, ParameterSet]
+
+        def deliver(subscription: Subscription, parameter_ids: Iterable[ParameterId]):
+            parameter_set = deliveries.setdefault(subscription, {})
+            delivered = self._delivered.get(subscription) if subscription[1] else None
+            for parameter_id in parameter_ids:
+                parameter = found.get(parameter_id)
+                if parameter is None:
+                    continue
+                if delivered is not None and not self._changed(
+                    delivered,
+                    (system_id, parameter_id),
+                    parameter.get("rawValue"),
+                    now,
+                ):
+                    continue
+                parameter_set[parameter["name"]] = parameter
+
+        scopes = ((None, None), (system_id, None))  # type: Tuple[Scope, ...]
+        for scope in scopes:
+            for subscription in self._index.get(scope, ()):
+                deliver(subscription, found)
+
+        for parameter_id in parameters:
+            scopes = ((None, parameter_id), (system_id, parameter_id))
+            for scope in scopes:
+                for subscription in self._index.get(scope, ()):
+                    deliver(subscription, (parameter_id,))
+
+        return {
+            subscription: parameter_set
+            for subscription, parameter_set in deliveries.items()
+            if parameter_set or not subscription[1]
+        }
 
     def call_callbacks(self, system_id: SystemId, parameters: List[Parameter]):
-        parameter_set = {}  #  type: ParameterSet
+        """Call callbacks subscribed to a list of parameters.
 
+        Parameters are routed by their name, use `call_parameters`
+        to route them by the ids they were subscribed with.
+        """
+        parameter_set = {}  # type: ParameterSet
         for parameter in parameters:
             if not parameter:
                 _LOGGER.debug("Parameter not found for system %s", system_id)
@@ -58,25 +497,76 @@ class Monitor:
 
             parameter_set[parameter["name"]] = parameter
 
-        for callback in self._callbacks:
-            callback(system_id, parameter_set)
+        self.call_parameters(system_id, parameter_set)
+
+    def call_parameters(
+        self, system_id: SystemId, parameters: Dict[ParameterId, Parameter]
+    ):
+        """Call callbacks subscribed to parameters, keyed by parameter id.
+
+        Callbacks in delta mode are only given parameters changed
+        since last delivered to them. Async callbacks are queued
+        without waiting, see `async_call_parameters`.
+        """
+        for (callback, _), parameter_set in self._route(
+            system_id, parameters
+        ).items():
+            queue = self._queues.get(callback)
+            if queue:
+                queue.put_nowait(system_id, parameter_set)
+            elif not asyncio.iscoroutinefunction(callback):
+                callback(system_id, parameter_set)
+
+    async def async_call_parameters(
+        self, system_id: SystemId, parameters: Dict[ParameterId, Parameter]
+    ):
+        """Call callbacks like `call_parameters`, waiting for blocking queues."""
+        for (callback, _), parameter_set in self._route(
+            system_id, parameters
+        ).items():
+            # callbacks may be removed while waiting for an earlier queue
+            if callback not in self._scopes:
+                continue
+
+            queue = self._queues.get(callback)
+            if queue:
+                await queue.put(system_id, parameter_set)
+            elif not asyncio.iscoroutinefunction(callback):
+                callback(system_id, parameter_set)
 
     async def run_once(self):
-        system_id, parameter_ids = next(self._iterator)
-        if not system_id:
+        system_id, parameter_ids = self._pop_due()
+        if not parameter_ids:
             return
 
         _LOGGER.debug("Requesting: %s %s", system_id, parameter_ids)
-        parameters = await asyncio.gather(
-            *[
-                self._uplink.get_parameter(system_id, parameter_id)
-                for parameter_id in parameter_ids
-            ]
+        parameters = await self._uplink.get_parameters(
+            system_id, parameter_ids, PRIORITY_BACKGROUND
         )
 
-        self.call_callbacks(system_id, parameters)
+        await self.async_call_parameters(system_id, parameters)
 
     async def run(self):
-        while True:
-            asyncio.sleep(4.5)
-            await self.run_once()
+        """Poll parameters as they are due, at most once every `delay` seconds."""
+        self._wakeup = asyncio.Event()
+        earliest = self._clock() + self._delay
+        try:
+            while True:
+                now = self._clock()
+                due = self.next_due()
+                if due is not None and max(earliest, due) <= now:
+                    earliest = now + self._delay
+                    await self.run_once()
+                    continue
+
+                # sleep until due, or until woken by a parameter due earlier
+                self._wake_at = None if due is None else max(earliest, due)
+                self._wakeup.clear()
+                timeout = None if due is None else self._wake_at - now
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._wakeup = None
+            self._wake_at = None
@@ -0,0 +1,121 @@
+"""Retrying of requests failing due to transient errors."""
+import asyncio
+import logging
+import random
+from collections import Counter
+from typing import Callable, Optional
+
+import aiohttp
+
+from .exceptions import ERROR_SYSTEM_OFFLINE, UplinkResponseException
+from .limiter import get_retry_after, is_rate_limited
+
+_LOGGER = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(["GET", "HEAD", "OPTIONS"])
+
+
+def is_connect_error(exc: BaseException) -> bool:
+    """Check if exception happened before request could be sent."""
+    return isinstance(exc, aiohttp.ClientConnectorError)
+
+
+def is_transient(exc: BaseException) -> bool:
+    """Check if exception is likely to go away if request is repeated."""
+    if is_rate_limited(exc):
+        # handled by the rate limiter of the caller
+        return False
+    if isinstance(exc, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc, UplinkResponseException) and exc.code == ERROR_SYSTEM_OFFLINE:
+        return True
+    cause = exc.__cause__
+    return isinstance(cause, aiohttp.ClientResponseError) and cause.status >= 500
+
+
+class RetryBudget:
+    """
+    Limit retries to a fraction of the requests made.
+
+    Each request adds `ratio` to the budget, and each retry withdraws
+    one from it. At most `reserve` retries can be saved up, which
+    is also what the budget starts with.
+    """
+
+    def __init__(self, ratio: float = 0.2, reserve: float = 5.0):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = reserve
+
+    def deposit(self):
+        self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RetryPolicy:
+    """
+    Decide if and when failed requests should be retried.
+
+    Idempotent requests are retried on any transient error, other
+    requests only when they could not be sent at all. Delays grow
+    exponentially from `base` up to `maximum` seconds, with full
+    jitter, or follow a Retry-After header if the server sent one.
+    """
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base: float = 1.0,
+        maximum: float = 30.0,
+        budget: Optional[RetryBudget] = None,
+        jitter: Callable[[float, float], float] = random.uniform,
+    ):
+        self.attempts = attempts
+        self.base = base
+        self.maximum = maximum
+        self.budget = budget or RetryBudget()
+        self.jitter = jitter
+        self.stats: "Counter[str]" = Counter()
+
+    def retryable(self, method: str, exc: BaseException) -> bool:
+        if method.upper() in IDEMPOTENT_METHODS:
+            return is_transient(exc)
+        return is_connect_error(exc)
+
+    def begin(self):
+        """Register a new request."""
+        self.budget.deposit()
+
+    def succeeded(self, attempt: int):
+        """Register the successful attempt of a request."""
+        if attempt:
+            self.stats["recovered"] += 1
+        else:
+            self.stats["succeeded"] += 1
+
+    def backoff(self, method: str, exc: BaseException, attempt: int) -> Optional[float]:
+        """Get delay before retrying a failed attempt, or None to give up."""
+        if not self.retryable(method, exc):
+            self.stats["failed"] += 1
+            return None
+
+        if attempt + 1 >= self.attempts:
+            self.stats["exhausted"] += 1
+            return None
+
+        if not self.budget.withdraw():
+            _LOGGER.debug("Retry budget exhausted, not retrying")
+            self.stats["throttled"] += 1
+            return None
+
+        self.stats["retried"] += 1
+        delay = self.jitter(0, min(self.maximum, self.base * 2 ** attempt))
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
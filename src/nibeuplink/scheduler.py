@@ -0,0 +1,104 @@
+"""Scheduling of requests to API by priority."""
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Optional, Tuple
+from typing_extensions import Deque
+
+_LOGGER = logging.getLogger(__name__)
+
+PRIORITY_WRITE = 0
+PRIORITY_READ = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITIES = (PRIORITY_WRITE, PRIORITY_READ, PRIORITY_BACKGROUND)
+
+
+class Slot:
+    def __init__(self, scheduler: "PriorityScheduler", priority: int):
+        self._scheduler = scheduler
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._scheduler.acquire(self._priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._scheduler.release()
+
+
+class PriorityScheduler:
+    """
+    Grants a limited number of request slots by priority.
+
+    Waiters are served lowest priority value first, and in arrival
+    order within a priority. To make sure lower priorities are never
+    starved, waiters are ranked one priority higher for every `aging`
+    seconds they have been waiting.
+    """
+
+    def __init__(self, concurrency: int = 1, aging: float = 60.0):
+        self._available = concurrency
+        self._aging = aging
+        self._waiters = {
+            priority: deque() for priority in PRIORITIES
+        }  # type: Dict[int, Deque[Tuple[float, asyncio.Future]]]
+
+    @property
+    def depth(self) -> Dict[int, int]:
+        """Number of waiters per priority."""
+        return {priority: len(queue) for priority, queue in self._waiters.items()}
+
+    def slot(self, priority: int = PRIORITY_READ) -> Slot:
+        return Slot(self, priority)
+
+    async def acquire(self, priority: int = PRIORITY_READ):
+        if self._available > 0 and not any(self._waiters.values()):
+            self._available -= 1
+            return
+
+        loop = asyncio.get_event_loop()
+        entry = (loop.time(), loop.create_future())
+        self._waiters[priority].append(entry)
+        try:
+            await entry[1]
+        except asyncio.CancelledError:
+            if entry[1].cancelled():
+                if entry in self._waiters[priority]:
+                    self._waiters[priority].remove(entry)
+            else:
+                # slot was granted as we got cancelled, pass it on
+                self.release()
+            raise
+
+    def release(self):
+        self._available += 1
+        while self._available > 0:
+            queue = self._next()
+            if queue is None:
+                return
+
+            _, future = queue.popleft()
+            if future.done():
+                continue
+            self._available -= 1
+            future.set_result(None)
+
+    def _next(self) -> Optional[Deque[Tuple[float, asyncio.Future]]]:
+        now = asyncio.get_event_loop().time()
+        best = None
+        best_rank = None
+        for priority, queue in self._waiters.items():
+            if not queue:
+                continue
+
+            timestamp = queue[0][0]
+            if self._aging:
+                rank = (priority - (now - timestamp) / self._aging, timestamp)
+            else:
+                rank = (priority, timestamp)
+
+            if best_rank is None or rank < best_rank:
+                best = queue
+                best_rank = rank
+        return best
@@ -1,5 +1,8 @@
 import aiohttp
+import asyncio
 import logging
+import random
+import time
 import uuid
 
 from datetime import datetime, timedelta
@@ -48,6 +51,12 @@ class UplinkSession:
         access_data_write=None,
         base="https://api.nibeuplink.com",
         scope=["READSYSTEM"],
+        refresh_margin=60.0,
+        refresh_jitter=30.0,
+        limit=10,
+        keepalive_timeout=60.0,
+        ttl_dns_cache=300,
+        warmup=False,
     ):
         self.redirect_uri = redirect_uri
         self.client_id = client_id
@@ -57,6 +66,14 @@ class UplinkSession:
         self.session = None
         self.scope = scope
         self.base = base
+        self.refresh_margin = refresh_margin
+        self.refresh_jitter = refresh_jitter
+        self.refresh_at = None
+        self._refresh = None
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.warmup = warmup
 
         # check that the access scope is enough, otherwise ignore
         if access_data:
@@ -81,12 +98,33 @@ class UplinkSession:
             "Content-Type": "application/x-www-form-urlencoded;charset=UTF-8",
         }
 
+        # keep connections alive well beyond the throttle delay, so
+        # consecutive requests can reuse the same tls session
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.ttl_dns_cache,
+        )
+
         self.session = aiohttp.ClientSession(
-            headers=headers, auth=aiohttp.BasicAuth(self.client_id, self.client_secret)
+            headers=headers,
+            auth=aiohttp.BasicAuth(self.client_id, self.client_secret),
+            connector=connector,
         )
 
         if self.access_data:
+            # the refresh will also establish the connection
             await self.refresh_access_token()
+        elif self.warmup:
+            await self.warm_up()
+
+    async def warm_up(self):
+        """Establish a connection to the API ahead of the first request."""
+        try:
+            async with self.session.head(self.base) as response:
+                _LOGGER.debug("Warmed up connection with status %s", response.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            _LOGGER.debug("Failed to warm up connection: %s", exc)
 
     async def close(self):
         if self.session:
@@ -100,15 +138,31 @@ class UplinkSession:
         if "expires_in" in data:
             _LOGGER.debug("Token will expire in %s seconds", data["expires_in"])
             expires = datetime.now() + timedelta(seconds=data["expires_in"])
+
+            # refresh ahead of expiry, spread out to avoid refreshing in sync
+            # with other sessions that got their tokens at the same time
+            refresh_in = (
+                data["expires_in"]
+                - self.refresh_margin
+                - random.uniform(0, self.refresh_jitter)
+            )
+            self.refresh_at = time.monotonic() + max(0.0, refresh_in)
         else:
             expires = None
+            self.refresh_at = None
 
-        data["access_token_expires"] = expires.isoformat()
+        data["access_token_expires"] = expires.isoformat() if expires else None
 
         self.access_data = data
         if self.access_data_write:
             self.access_data_write(data)
 
+    def _get_access_token(self):
+        if self.access_data:
+            return self.access_data["access_token"]
+        else:
+            return None
+
     async def _get_auth(self):
         if self.access_data:
             return BearerAuth(self.access_data["access_token"])
@@ -129,8 +183,23 @@ class UplinkSession:
             self._handle_access_token(await response.json())
 
     async def refresh_access_token(self):
+        """Refresh access token, or wait for a refresh already in progress."""
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._refresh_access_token())
+            self._refresh.add_done_callback(self._refresh_done)
+
+        await asyncio.shield(self._refresh)
+
+    def _refresh_done(self, future):
+        self._refresh = None
+        if not future.cancelled():
+            # mark as retrieved, callers will get it raised
+            future.exception()
+
+    async def _refresh_access_token(self):
         if not self.access_data or "refresh_token" not in self.access_data:
             _LOGGER.warning("No refresh token available for refresh")
+            self.refresh_at = None
             return
 
         _LOGGER.debug(
@@ -171,20 +240,47 @@ class UplinkSession:
             )
         return query["code"][0]
 
-    async def request(self, *args, **kw):
+    async def send(self, *args, **kw) -> aiohttp.ClientResponse:
+        """Send request and check status of response.
+
+        The body of the returned response is not read, caller is
+        responsible for reading it using `read`, or closing it.
+        """
+        if self.refresh_at is not None and time.monotonic() >= self.refresh_at:
+            _LOGGER.debug("Refreshing access token ahead of expiry")
+            try:
+                await self.refresh_access_token()
+            except (UplinkException, aiohttp.ClientError) as exc:
+                # request will refresh the token if it has expired
+                _LOGGER.warning("Failed to refresh access token: %s", exc)
+                self.refresh_at = None
+
+        token = self._get_access_token()
         response = await self.session.request(*args, auth=await self._get_auth(), **kw)
         try:
             if response.status == 401:
                 _LOGGER.debug(response)
-                _LOGGER.info("Attempting to refresh token due to error in request")
-                await self.refresh_access_token()
                 response.close()
+
+                # only refresh if no other request did so while we waited
+                if self._get_access_token() == token:
+                    _LOGGER.info("Attempting to refresh token due to error in request")
+                    await self.refresh_access_token()
+
                 response = await self.session.request(
                     *args, auth=await self._get_auth(), **kw
                 )
 
             await raise_for_status(response)
+        except BaseException:
+            response.close()
+            raise
+
+        return response
 
+    async def read(self, response: aiohttp.ClientResponse):
+        """Read and decode body of a response returned by `send`."""
+        try:
             if "json" in response.headers.get("CONTENT-TYPE", ""):
                 data = await response.json()
             else:
@@ -194,3 +290,6 @@ class UplinkSession:
 
         finally:
             response.close()
+
+    async def request(self, *args, **kw):
+        return await self.read(await self.send(*args, **kw))
@@ -0,0 +1,87 @@
+"""Helpers to publish thermostat readings."""
+import asyncio
+import logging
+from typing import Dict
+
+import aiohttp
+
+from .exceptions import UplinkException
+from .typing import SetThermostatModel, SystemId
+from .uplink import Uplink
+
+_LOGGER = logging.getLogger(__name__)
+
+DEADBAND_KEYS = ("actualTemp", "targetTemp")
+
+
+class ThermostatPublisher:
+    """
+    Publishing of external thermostats to a system.
+
+    Only the latest reading of each thermostat is kept, and on every
+    flush the thermostats that changed since they were last posted
+    are sent. Temperature changes smaller than `deadband`, given in
+    tenths of degrees like the temperatures themselves, are dropped.
+    """
+
+    def __init__(
+        self,
+        uplink: Uplink,
+        system_id: SystemId,
+        interval: float = 60.0,
+        deadband: int = 0,
+    ):
+        self._uplink = uplink
+        self._system_id = system_id
+        self._interval = interval
+        self._deadband = deadband
+        self._pending = {}  # type: Dict[int, SetThermostatModel]
+        self._published = {}  # type: Dict[int, SetThermostatModel]
+
+    def _changed(self, old: SetThermostatModel, new: SetThermostatModel) -> bool:
+        for key, value in new.items():
+            previous = old.get(key)
+            if value == previous:
+                continue
+            if (
+                key in DEADBAND_KEYS
+                and isinstance(value, (int, float))
+                and isinstance(previous, (int, float))
+            ):
+                if abs(value - previous) >= self._deadband:
+                    return True
+            else:
+                return True
+        return False
+
+    def update(self, thermostat: SetThermostatModel):
+        external_id = thermostat["externalId"]
+        published = self._published.get(external_id)
+        if published is not None and not self._changed(published, thermostat):
+            self._pending.pop(external_id, None)
+            return
+        self._pending[external_id] = thermostat
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        while pending:
+            external_id, thermostat = next(iter(pending.items()))
+            try:
+                await self._uplink.post_smarthome_thermostats(
+                    self._system_id, thermostat
+                )
+            except BaseException:
+                # keep unsent for next flush, unless replaced meanwhile
+                for key, value in pending.items():
+                    self._pending.setdefault(key, value)
+                raise
+            del pending[external_id]
+            self._published[external_id] = thermostat
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.flush()
+            except (UplinkException, aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                _LOGGER.warning("Failed to publish thermostats: %s", exc)
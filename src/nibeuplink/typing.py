@@ -56,7 +56,7 @@ class SetThermostatModel(TypedDict):
 
 class ParameterType(TypedDict, total=False):
     parameterId: int
-    Name: str
+    name: str
     title: str
     designation: str
     unit: str
@@ -3,10 +3,23 @@ import attr
 import logging
 import asyncio
 import aiohttp
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Union, cast
+import math
+from functools import partial
+from itertools import islice
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Any,
+    Tuple,
+    Union,
+    cast,
+)
 
-from .utils import chunks, chunk_pop
+from .utils import chunks, chunk_pop_dict
 from .typing import (
     CategoryType, ParameterType, StatusItemIcon,
     ParameterId, SystemSoftwareInfo,
@@ -15,55 +28,101 @@ from .typing import (
     System,
     SystemUnit,
 )
+from .cache import NegativeCache, ParameterCache
 from .const import MAX_REQUEST_PARAMETERS
+from .exceptions import (
+    ERROR_NO_METADATA,
+    ERROR_UNKNOWN_PARAMETER,
+    UplinkException,
+    UplinkResponseException,
+)
+from .limiter import Throttle, TokenBucket
+from .retry import RetryPolicy
+from .scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_READ,
+    PRIORITY_WRITE,
+    PriorityScheduler,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+# error codes for a parameter batch containing a bad parameter id
+INVALID_PARAMETER_CODES = (ERROR_NO_METADATA, ERROR_UNKNOWN_PARAMETER)
+
 
 class ParameterRequest:
-    def __init__(self, parameter_id: str):
+    def __init__(
+        self,
+        parameter_id: str,
+        priority: int = PRIORITY_READ,
+        deadline: Optional[float] = None,
+    ):
+        loop = asyncio.get_event_loop()
         self.parameter_id = parameter_id
-        self.data: Optional[ParameterType] = None
-        self.done = False
-
-
-class Throttle:
-    """
-    Throttling requests to API.
-
-    Works by awaiting our turn then executing the request,
-    and scheduling next request at a delay after the previous
-    request completed.
-    """
-
-    def __init__(self, delay):
-        self._delay = delay
-        self._timestamp = datetime.now()
+        self.priority = priority
+        self.deadline = deadline
+        self.waiters = 0
+        self.timestamp = loop.time()
+        self.future: "asyncio.Future[Optional[ParameterType]]" = (
+            loop.create_future()
+        )
 
-    async def __aenter__(self):
-        timestamp = datetime.now()
-        delay = (self._timestamp - timestamp).total_seconds()
-        if delay > 0:
-            _LOGGER.debug("Delaying request by %s seconds due to throttle", delay)
-            await asyncio.sleep(delay)
-        return self
 
-    async def __aexit__(self, exc_type, exc_val, exc_tb):
-        self._timestamp = datetime.now() + self._delay
+class ParameterWrite:
+    def __init__(self, parameter_id: str, value: Any):
+        self.parameter_id = parameter_id
+        self.value = value
+        self.future: "asyncio.Future[Optional[str]]" = (
+            asyncio.get_event_loop().create_future()
+        )
 
 
 class Uplink:
     def __init__(
-        self, session, loop=None, base="https://api.nibeuplink.com", throttle=4.5
+        self,
+        session,
+        loop=None,
+        base="https://api.nibeuplink.com",
+        throttle=4.5,
+        burst=1,
+        limiter=None,
+        concurrency=1,
+        cache: Optional[ParameterCache] = None,
+        missing: Optional[NegativeCache] = None,
+        linger: float = 0.0,
+        fill: int = MAX_REQUEST_PARAMETERS,
+        aging: float = 60.0,
+        result_ttl: float = 0.0,
+        retry: Optional[RetryPolicy] = None,
     ):
 
+        if limiter is None:
+            limiter = TokenBucket(1.0 / throttle if throttle else math.inf, burst)
+
         self.state = None
-        self.lock = asyncio.Lock()
-        self.throttle = Throttle(timedelta(seconds=throttle))
+        self.scheduler = PriorityScheduler(concurrency, aging)
+        self.system_locks: Dict[int, asyncio.Lock] = {}
+        self.throttle = limiter
+        self.cache = cache
+        self.missing = missing
+        self.invalid: Dict[int, Dict[str, UplinkResponseException]] = {}
         self.session = session
         self.loop = loop
         self.base = base
-        self.requests: Dict[int, List[ParameterRequest]] = {}
+        self.requests: Dict[int, Dict[str, ParameterRequest]] = {}
+        self.dispatchers: Dict[int, "asyncio.Future[None]"] = {}
+        self.filled: Dict[int, asyncio.Event] = {}
+        self.writes: Dict[int, Dict[str, ParameterWrite]] = {}
+        self.writers: Dict[int, "asyncio.Future[None]"] = {}
+        self.linger = linger
+        self.fill = fill
+        self.batches = 0
+        self.batched_parameters = 0
+        self.shared: Dict[Tuple, "asyncio.Future[Any]"] = {}
+        self.results: Dict[Tuple, Tuple[float, Any]] = {}
+        self.result_ttl = result_ttl
+        self.retry = retry or RetryPolicy()
 
     async def __aenter__(self):
         return self
@@ -73,74 +132,434 @@ class Uplink:
 
     async def close(self):
         """Close uplink and clear any outstanding requests"""
-        async with self.lock:
-            for requests in self.requests.values():
-                while requests:
-                    requests.pop().done = True
+        for requests in self.requests.values():
+            while requests:
+                _, request = requests.popitem()
+                if not request.future.done():
+                    request.future.set_result(None)
+        for writes in self.writes.values():
+            while writes:
+                _, write = writes.popitem()
+                if not write.future.done():
+                    write.future.set_result(None)
+
+        # stop requests in flight, which resolve their waiters when cancelled
+        tasks = [
+            *self.dispatchers.values(),
+            *self.writers.values(),
+            *self.shared.values(),
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def system_lock(self, system_id: int) -> asyncio.Lock:
+        """Lock used to keep order of requests that modify a system."""
+        if system_id not in self.system_locks:
+            self.system_locks[system_id] = asyncio.Lock()
+        return self.system_locks[system_id]
+
+    async def send(self, method, url, *args, **kwargs) -> aiohttp.ClientResponse:
+        return await self.session.send(
+            method, f"{self.base}/api/v1/{url}", *args, **kwargs
+        )
+
+    async def _retry(
+        self,
+        method: str,
+        attempt: Callable[[], Awaitable[Optional[aiohttp.ClientResponse]]],
+    ) -> Optional[aiohttp.ClientResponse]:
+        """Run attempts of a request until one succeeds or retry policy gives up.
+
+        Each attempt is expected to take its own scheduler slot and
+        limiter token, so that neither is held while waiting to retry.
+        """
+        self.retry.begin()
+        count = 0
+        while True:
+            try:
+                response = await attempt()
+            except (UplinkException, aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                delay = self.retry.backoff(method, exc, count)
+                if delay is None:
+                    raise
+                _LOGGER.info(
+                    "Retrying request in %.1f seconds due to error: %s", delay, exc
+                )
+                await asyncio.sleep(delay)
+                count += 1
+            else:
+                self.retry.succeeded(count)
+                return response
+
+    async def request(self, method, url, *args, priority=PRIORITY_READ, **kwargs):
+        async def attempt():
+            async with self.scheduler.slot(priority), self.throttle:
+                return await self.send(method, url, *args, **kwargs)
+
+        response = await self._retry(method, attempt)
+
+        # body is decoded outside of slot to let next request start
+        return await self.session.read(response)
 
     async def get(self, url, *args, **kwargs):
-        return await self.session.request(
-            "GET", f"{self.base}/api/v1/{url}", *args, **kwargs
-        )
+        return await self.request("GET", url, *args, **kwargs)
 
-    async def put(self, url, *args, **kwargs):
-        return await self.session.request(
-            "PUT", f"{self.base}/api/v1/{url}", *args, **kwargs
-        )
+    async def get_shared(self, url, params=None):
+        """GET request shared with identical concurrent requests.
 
-    async def post(self, url, *args, **kwargs):
-        return await self.session.request(
-            "POST", f"{self.base}/api/v1/{url}", *args, **kwargs
-        )
+        With result_ttl set, the result is also reused for that
+        many seconds after it was received.
+        """
+        key = (url, tuple(sorted((params or {}).items())))
 
-    async def get_parameter_raw(self, system_id: int, parameter_id: ParameterId) -> Optional[ParameterType]:
+        if self.result_ttl:
+            entry = self.results.get(key)
+            if entry is not None:
+                if asyncio.get_event_loop().time() < entry[0]:
+                    return entry[1]
+                del self.results[key]
 
-        request = ParameterRequest(str(parameter_id))
-        if system_id not in self.requests:
-            self.requests[system_id] = []
-        self.requests[system_id].append(request)
+        future = self.shared.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self.get(url, params=params))
+            future.add_done_callback(partial(self._shared_done, key))
+            self.shared[key] = future
 
-        # yield to any other runnable that want to add requests
-        await asyncio.sleep(0)
+        # shielded since the request may be shared with other callers
+        return await asyncio.shield(future)
 
-        while True:
-            async with self.lock:
+    def _shared_done(self, key: Tuple, future: "asyncio.Future[Any]"):
+        del self.shared[key]
+        if future.cancelled() or future.exception() or not self.result_ttl:
+            return
 
-                # check if we are already finished, by somebody elses request
-                if request.done:
-                    break
+        expires = asyncio.get_event_loop().time() + self.result_ttl
+        self.results[key] = (expires, future.result())
 
-                if len(self.requests[system_id]) == 0:
-                    break
+    async def put(self, url, *args, **kwargs):
+        return await self.request("PUT", url, *args, **kwargs)
 
-                async with self.throttle:
-                    # chop of as many requests from start as possible
-                    requests = chunk_pop(
-                        self.requests[system_id], MAX_REQUEST_PARAMETERS
-                    )
+    async def post(self, url, *args, **kwargs):
+        return await self.request("POST", url, *args, **kwargs)
 
-                    _LOGGER.debug(
-                        "Requesting parameters {}".format(
-                            [str(x.parameter_id) for x in requests]
-                        )
-                    )
+    async def get_parameter_raw(
+        self,
+        system_id: int,
+        parameter_id: ParameterId,
+        priority: int = PRIORITY_READ,
+        timeout: Optional[float] = None,
+    ) -> Optional[ParameterType]:
 
-                    data = await self.get(
-                        f"systems/{system_id}/parameters",
-                        params=[
-                            ("parameterIds", str(x.parameter_id)) for x in requests
-                        ],
-                        headers={},
-                    )
+        key = str(parameter_id)
+        invalid = self.invalid.get(system_id, {}).get(key)
+        if invalid is not None:
+            raise UplinkResponseException(invalid.code, invalid.data)
 
-                lookup = {p["name"]: p for p in data}
+        if self.missing is not None and self.missing.excluded(system_id, parameter_id):
+            return None
 
-                for r in requests:
-                    r.done = True
-                    if r.parameter_id in lookup:
-                        r.data = lookup[r.parameter_id]
+        if system_id not in self.requests:
+            self.requests[system_id] = {}
+        queue = self.requests[system_id]
+
+        if timeout is None:
+            deadline = None
+        else:
+            deadline = asyncio.get_event_loop().time() + timeout
+
+        # share any already queued request for the same parameter
+        request = queue.get(key)
+        if request is None:
+            request = ParameterRequest(key, priority, deadline)
+            queue[key] = request
+        else:
+            request.priority = min(request.priority, priority)
+            if request.deadline is not None:
+                request.deadline = None if deadline is None else max(
+                    request.deadline, deadline
+                )
+
+        if system_id not in self.dispatchers:
+            self.filled[system_id] = asyncio.Event()
+            self.dispatchers[system_id] = asyncio.ensure_future(
+                self._dispatch_parameters(system_id)
+            )
+        elif len(queue) >= self.fill:
+            self.filled[system_id].set()
+
+        request.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(request.future), timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            request.waiters -= 1
+            if not request.waiters and not request.future.done():
+                # nobody is waiting anymore, so drop it if still queued
+                if self.requests.get(system_id, {}).get(key) is request:
+                    del self.requests[system_id][key]
+                request.future.cancel()
+            raise
+
+    def _expire_parameters(self, queue: Dict[str, ParameterRequest]):
+        """Drop queued requests whose deadline has passed."""
+        now = asyncio.get_event_loop().time()
+        expired = [
+            key
+            for key, r in queue.items()
+            if r.deadline is not None and r.deadline <= now
+        ]
+        for key in expired:
+            request = queue.pop(key)
+            if not request.future.done():
+                request.future.set_exception(asyncio.TimeoutError())
+
+    async def _send_parameters(
+        self, system_id: int, keys: List[str]
+    ) -> aiohttp.ClientResponse:
+        _LOGGER.debug("Requesting parameters {}".format(keys))
+        self.batches += 1
+        self.batched_parameters += len(keys)
+
+        return await self.send(
+            "GET",
+            f"systems/{system_id}/parameters",
+            params=[("parameterIds", key) for key in keys],
+            headers={},
+        )
 
-        return request.data
+    def _store_parameters(
+        self, system_id: int, keys: List[str], data: List[ParameterType]
+    ) -> Dict[str, ParameterType]:
+        lookup = {p["name"]: p for p in data}
+
+        result = {}
+        for key in keys:
+            value = lookup.get(key)
+            if value:
+                result[key] = value
+                if self.cache is not None:
+                    self.cache.set(system_id, key, value)
+                if self.missing is not None:
+                    self.missing.found(system_id, key)
+            elif self.missing is not None:
+                self.missing.missing(system_id, key)
+        return result
+
+    def _fail_parameters(self, requests: List[ParameterRequest], exc: Exception):
+        for r in requests:
+            if not r.future.done():
+                r.future.set_exception(exc)
+
+    async def _fetch_parameters(
+        self, system_id: int, keys: List[str], priority: int = PRIORITY_READ
+    ) -> Dict[str, ParameterType]:
+        """Request a single batch of parameters."""
+
+        async def attempt():
+            async with self.scheduler.slot(priority), self.throttle:
+                return await self._send_parameters(system_id, keys)
+
+        try:
+            response = await self._retry("GET", attempt)
+            data = await self.session.read(response)
+        except UplinkResponseException as exc:
+            if exc.code not in INVALID_PARAMETER_CODES:
+                raise
+            return await self._bisect_parameters(system_id, keys, exc, priority)
+
+        return self._store_parameters(system_id, keys, data)
+
+    async def _bisect_parameters(
+        self,
+        system_id: int,
+        keys: List[str],
+        exc: UplinkResponseException,
+        priority: int = PRIORITY_READ,
+    ) -> Dict[str, ParameterType]:
+        """Split a batch failing due to an invalid parameter to find it.
+
+        Invalid parameters are remembered for the system, while the
+        remaining parameters are answered by the sub batches.
+        """
+        if len(keys) == 1:
+            _LOGGER.warning(
+                "Parameter %s on system %s is invalid: %s", keys[0], system_id, exc.name
+            )
+            self.invalid.setdefault(system_id, {})[keys[0]] = exc
+            return {}
+
+        half = len(keys) // 2
+        result = await self._fetch_parameters(system_id, keys[:half], priority)
+        result.update(await self._fetch_parameters(system_id, keys[half:], priority))
+        return result
+
+    async def get_parameters(
+        self,
+        system_id: int,
+        parameter_ids: Iterable[ParameterId],
+        priority: int = PRIORITY_READ,
+    ) -> Dict[ParameterId, ParameterType]:
+        """Get multiple parameters of a system.
+
+        Parameters are requested directly in chunks of at most
+        MAX_REQUEST_PARAMETERS, without going through the queue
+        used by get_parameter. Result is keyed by the requested
+        parameter ids, parameters not available are left out.
+        """
+        result: Dict[ParameterId, ParameterType] = {}
+        pending: Dict[str, List[ParameterId]] = {}
+        invalid = self.invalid.get(system_id, {})
+
+        for parameter_id in parameter_ids:
+            key = str(parameter_id)
+            if key in invalid:
+                continue
+
+            if self.missing is not None and self.missing.excluded(system_id, key):
+                continue
+
+            if self.cache is not None:
+                data, fresh = self.cache.lookup(system_id, key)
+                if data is not None:
+                    if not fresh:
+                        self._refresh_parameter(system_id, parameter_id)
+                    result[parameter_id] = data
+                    continue
+
+            pending.setdefault(key, []).append(parameter_id)
+
+        keys = list(pending)
+        batches = await asyncio.gather(
+            *[
+                self._fetch_parameters(
+                    system_id, keys[index : index + MAX_REQUEST_PARAMETERS], priority
+                )
+                for index in range(0, len(keys), MAX_REQUEST_PARAMETERS)
+            ]
+        )
+        for batch in batches:
+            for key, data in batch.items():
+                for parameter_id in pending[key]:
+                    result[parameter_id] = data
+
+        for data in result.values():
+            self.add_parameter_extensions(data)
+        return result
+
+    @property
+    def batch_fill_ratio(self) -> float:
+        """Average ratio of parameter slots used in requests sent."""
+        if not self.batches:
+            return 0.0
+        return self.batched_parameters / (self.batches * MAX_REQUEST_PARAMETERS)
+
+    async def _linger(self, system_id: int, queue: Dict[str, ParameterRequest]):
+        """Wait for queue to reach fill level or oldest request to linger out."""
+        if not queue or len(queue) >= self.fill:
+            return
+
+        oldest = next(iter(queue.values()))
+        delay = oldest.timestamp + self.linger - asyncio.get_event_loop().time()
+        if delay <= 0:
+            return
+
+        filled = self.filled[system_id]
+        filled.clear()
+        try:
+            await asyncio.wait_for(filled.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _dispatch_parameters(self, system_id: int):
+        """Send queued parameter requests for a system in batches.
+
+        One dispatcher runs per system while it has queued requests,
+        waiters are resolved through their future once their batch
+        has been answered.
+        """
+        try:
+            # yield to any other runnable that want to add requests
+            await asyncio.sleep(0)
+
+            queue = self.requests[system_id]
+            while queue:
+                await self._linger(system_id, queue)
+                if not queue:
+                    break
+
+                # batch is sent with the most urgent priority of its requests
+                priority = min(
+                    r.priority for r in islice(queue.values(), MAX_REQUEST_PARAMETERS)
+                )
+
+                requests: List[ParameterRequest] = []
+                keys: List[str] = []
+
+                async def attempt():
+                    nonlocal requests, keys
+                    async with self.scheduler.slot(priority):
+                        if not requests:
+                            if not queue:
+                                return None
+
+                            async with self.throttle:
+                                # chop of as many requests from start as possible
+                                self._expire_parameters(queue)
+                                requests = chunk_pop_dict(
+                                    queue, MAX_REQUEST_PARAMETERS
+                                )
+                                if not requests:
+                                    return None
+                                keys = [r.parameter_id for r in requests]
+                                return await self._send_parameters(system_id, keys)
+
+                        # retry of the batch already popped
+                        async with self.throttle:
+                            return await self._send_parameters(system_id, keys)
+
+                try:
+                    response = await self._retry("GET", attempt)
+                    if response is None:
+                        continue
+
+                    data = await self.session.read(response)
+                    result = self._store_parameters(system_id, keys, data)
+                except UplinkResponseException as exc:
+                    if exc.code not in INVALID_PARAMETER_CODES:
+                        self._fail_parameters(requests, exc)
+                        continue
+                    try:
+                        result = await self._bisect_parameters(
+                            system_id, keys, exc, priority
+                        )
+                    except Exception as e:
+                        self._fail_parameters(requests, e)
+                        continue
+                except asyncio.CancelledError:
+                    for r in requests:
+                        if not r.future.done():
+                            r.future.set_result(None)
+                    raise
+                except Exception as exc:
+                    self._fail_parameters(requests, exc)
+                    continue
+
+                invalid = self.invalid.get(system_id, {})
+                for r in requests:
+                    if r.future.done():
+                        continue
+                    if r.parameter_id in invalid:
+                        error = invalid[r.parameter_id]
+                        r.future.set_exception(
+                            UplinkResponseException(error.code, error.data)
+                        )
+                    else:
+                        r.future.set_result(result.get(r.parameter_id))
+        finally:
+            del self.dispatchers[system_id]
+            del self.filled[system_id]
+            if not self.requests.get(system_id):
+                self.requests.pop(system_id, None)
 
     def add_parameter_extensions(self, data: Optional[ParameterType]):
         if data:
@@ -158,41 +577,163 @@ class Uplink:
             else:
                 data["value"] = data["displayValue"]
 
-    async def get_parameter(self, system_id: int, parameter_id: ParameterId):
-        data = await self.get_parameter_raw(system_id, parameter_id)
+    def _refresh_parameter(self, system_id: int, parameter_id: ParameterId):
+        """Queue a parameter for refresh in the next batch, without waiting."""
+
+        def done(task):
+            if not task.cancelled() and task.exception():
+                _LOGGER.debug(
+                    "Failed to refresh parameter %s on system %s: %s",
+                    parameter_id,
+                    system_id,
+                    task.exception(),
+                )
+
+        task = asyncio.ensure_future(
+            self.get_parameter_raw(system_id, parameter_id, PRIORITY_BACKGROUND)
+        )
+        task.add_done_callback(done)
+
+    async def get_parameter(
+        self,
+        system_id: int,
+        parameter_id: ParameterId,
+        priority: int = PRIORITY_READ,
+        timeout: Optional[float] = None,
+    ):
+        if self.cache is not None:
+            data, fresh = self.cache.lookup(system_id, parameter_id)
+            if data is not None:
+                if not fresh:
+                    self._refresh_parameter(system_id, parameter_id)
+                self.add_parameter_extensions(data)
+                return data
+
+        data = await self.get_parameter_raw(system_id, parameter_id, priority, timeout)
         self.add_parameter_extensions(data)
         return data
 
     async def put_parameter(
         self, system_id: int, parameter_id: ParameterId, value: Any
     ):
+        if system_id not in self.writes:
+            self.writes[system_id] = {}
+        queue = self.writes[system_id]
+
+        # replace value of any already queued write of the same parameter
+        key = str(parameter_id)
+        write = queue.get(key)
+        if write is None:
+            write = ParameterWrite(key, value)
+            queue[key] = write
+        else:
+            write.value = value
+
+        if system_id not in self.writers:
+            self.writers[system_id] = asyncio.ensure_future(
+                self._dispatch_writes(system_id)
+            )
+
+        return await asyncio.shield(write.future)
+
+    def _invalidate_writes(self, system_id: int, writes: List[ParameterWrite]):
+        """Drop cached values of written parameters, so they are read again."""
+        if self.cache is not None:
+            for w in writes:
+                self.cache.delete(system_id, w.parameter_id)
+
+    async def _dispatch_writes(self, system_id: int):
+        """Send queued parameter writes for a system merged into single requests.
+
+        Status of each parameter in the response is reported back
+        to the callers that wrote it.
+        """
         headers = {
             "Accept": "application/json",
             "Content-Type": "application/json;charset=UTF-8",
         }
 
-        data = {"settings": {str(parameter_id): value}}
-        async with self.lock, self.throttle:
-            result = await self.put(
-                f"systems/{system_id}/parameters", json=data, headers=headers,
-            )
-        return result[0]["status"]
+        try:
+            # yield to any other runnable that want to add writes
+            await asyncio.sleep(0)
+
+            queue = self.writes[system_id]
+            while queue:
+                writes: List[ParameterWrite] = []
+
+                async def attempt():
+                    nonlocal writes
+                    async with self.scheduler.slot(PRIORITY_WRITE):
+                        if not writes and not queue:
+                            return None
+
+                        async with self.throttle:
+                            if not writes:
+                                writes = chunk_pop_dict(queue, MAX_REQUEST_PARAMETERS)
+                            data = {
+                                "settings": {w.parameter_id: w.value for w in writes}
+                            }
+                            _LOGGER.debug("Writing parameters %s", data)
+                            return await self.send(
+                                "PUT",
+                                f"systems/{system_id}/parameters",
+                                json=data,
+                                headers=headers,
+                            )
+
+                try:
+                    # lock is held over retries to keep order of writes
+                    async with self.system_lock(system_id):
+                        response = await self._retry("PUT", attempt)
+                        if response is None:
+                            continue
+                        result = await self.session.read(response)
+
+                    if len(result) != len(writes):
+                        _LOGGER.warning(
+                            "Unexpected result %s when writing %s",
+                            result,
+                            [w.parameter_id for w in writes],
+                        )
+
+                    statuses = [
+                        result[index]["status"] if index < len(result) else None
+                        for index in range(len(writes))
+                    ]
+                except asyncio.CancelledError:
+                    for w in writes:
+                        if not w.future.done():
+                            w.future.set_result(None)
+                    raise
+                except Exception as exc:
+                    for w in writes:
+                        if not w.future.done():
+                            w.future.set_exception(exc)
+                    continue
+                finally:
+                    # write may have reached the system even if it failed
+                    self._invalidate_writes(system_id, writes)
+
+                for w, status in zip(writes, statuses):
+                    if not w.future.done():
+                        w.future.set_result(status)
+        finally:
+            del self.writers[system_id]
+            if not self.writes.get(system_id):
+                self.writes.pop(system_id, None)
 
     async def get_system(self, system_id: int) -> System:
         _LOGGER.debug("Requesting system {}".format(system_id))
-        async with self.lock, self.throttle:
-            return cast(System, await self.get(f"systems/{system_id}"))
+        return cast(System, await self.get_shared(f"systems/{system_id}"))
 
     async def get_system_software(self, system_id: int) -> SystemSoftwareInfo:
         _LOGGER.debug("Requesting system software {}".format(system_id))
-        async with self.lock, self.throttle:
-            return cast(SystemSoftwareInfo, await self.get(f"systems/{system_id}/software"))
+        return cast(SystemSoftwareInfo, await self.get(f"systems/{system_id}/software"))
 
     async def get_systems(self) -> List[System]:
         _LOGGER.debug("Requesting systems")
-        async with self.lock, self.throttle:
-            data = await self.get("systems")
-            return cast(List[System], data["objects"])
+        data = await self.get("systems")
+        return cast(List[System], data["objects"])
 
     async def get_category_raw(
         self, system_id: int, category_id: str, unit_id: int = 0
@@ -200,11 +741,10 @@ class Uplink:
         _LOGGER.debug(
             "Requesting category {} on system {}".format(category_id, system_id)
         )
-        async with self.lock, self.throttle:
-            return await self.get(
-                f"systems/{system_id}/serviceinfo/categories/{category_id}",
-                {"systemUnitId": unit_id},
-            )
+        return await self.get(
+            f"systems/{system_id}/serviceinfo/categories/{category_id}",
+            {"systemUnitId": unit_id},
+        )
 
     async def get_category(self, system_id: int, category_id: str, unit_id: int = 0) -> List[ParameterType]:
         data = await self.get_category_raw(system_id, category_id, unit_id)
@@ -215,11 +755,10 @@ class Uplink:
     async def get_categories(self, system_id: int, parameters: bool, unit_id: int = 0) -> List[CategoryType]:
         _LOGGER.debug("Requesting categories on system {}".format(system_id))
 
-        async with self.lock, self.throttle:
-            data: List[CategoryType] = await self.get(
-                f"systems/{system_id}/serviceinfo/categories",
-                params={"parameters": str(parameters), "systemUnitId": unit_id},
-            )
+        data: List[CategoryType] = await self.get_shared(
+            f"systems/{system_id}/serviceinfo/categories",
+            params={"parameters": str(parameters), "systemUnitId": unit_id},
+        )
         for category in data:
             if category["parameters"]:
                 for param in category["parameters"]:
@@ -228,8 +767,7 @@ class Uplink:
 
     async def get_status_raw(self, system_id: int):
         _LOGGER.debug("Requesting status on system {}".format(system_id))
-        async with self.lock, self.throttle:
-            return await self.get(f"systems/{system_id}/status/system")
+        return await self.get_shared(f"systems/{system_id}/status/system")
 
     async def get_status(self, system_id: int) -> List[StatusItemIcon]:
         data = await self.get_status_raw(system_id)
@@ -241,13 +779,11 @@ class Uplink:
 
     async def get_units(self, system_id: int) -> List[SystemUnit]:
         _LOGGER.debug("Requesting units on system {}".format(system_id))
-        async with self.lock, self.throttle:
-            return await self.get(f"systems/{system_id}/units")
+        return await self.get_shared(f"systems/{system_id}/units")
 
     async def get_unit_status(self, system_id: int, unit_id: int):
         _LOGGER.debug("Requesting unit {} on system {}".format(unit_id, system_id))
-        async with self.lock, self.throttle:
-            data = await self.get(f"systems/{system_id}/status/systemUnit/{unit_id}")
+        data = await self.get(f"systems/{system_id}/status/systemUnit/{unit_id}")
         for status in data:
             if status["parameters"]:
                 for param in status["parameters"]:
@@ -263,13 +799,11 @@ class Uplink:
             "itemsPerPage": 100,
             "type": notifiction_type,
         }
-        async with self.lock, self.throttle:
-            data = await self.get(f"systems/{system_id}/notifications", params=params)
+        data = await self.get_shared(f"systems/{system_id}/notifications", params=params)
         return data["objects"]
 
     async def get_smarthome_mode(self, system_id: int) -> str:
-        async with self.lock, self.throttle:
-            data = await self.get(f"systems/{system_id}/smarthome/mode")
+        data = await self.get(f"systems/{system_id}/smarthome/mode")
         mode = data["mode"]
         _LOGGER.debug("Get smarthome mode %s", mode)
         return mode
@@ -281,15 +815,17 @@ class Uplink:
         }
 
         data = {"mode": mode}
-        async with self.lock, self.throttle:
+        async with self.system_lock(system_id):
             data = await self.put(
-                f"systems/{system_id}/smarthome/mode", json=data, headers=headers,
+                f"systems/{system_id}/smarthome/mode",
+                json=data,
+                headers=headers,
+                priority=PRIORITY_WRITE,
             )
         _LOGGER.debug("Set smarthome mode %s -> %s", mode, data)
 
     async def get_smarthome_thermostats(self, system_id: int) -> List[Thermostat]:
-        async with self.lock, self.throttle:
-            data = await self.get(f"systems/{system_id}/smarthome/thermostats")
+        data = await self.get(f"systems/{system_id}/smarthome/thermostats")
         _LOGGER.debug("Get smarthome thermostats %s", data)
         return data
 
@@ -302,7 +838,10 @@ class Uplink:
         }
 
         _LOGGER.debug("Post smarthome thermostat: %s", thermostat)
-        async with self.lock, self.throttle:
+        async with self.system_lock(system_id):
             await self.post(
-                f"systems/{system_id}/smarthome/thermostats", json=thermostat, headers=headers,
+                f"systems/{system_id}/smarthome/thermostats",
+                json=thermostat,
+                headers=headers,
+                priority=PRIORITY_WRITE,
             )
@@ -68,3 +68,8 @@ def chunk_pop(data, SIZE):
     res = data[0:count]
     del data[0:count]
     return res
+
+
+def chunk_pop_dict(data, SIZE):
+    keys = list(islice(data, SIZE))
+    return [data.pop(key) for key in keys]
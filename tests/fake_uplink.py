@@ -40,6 +40,7 @@ class Uplink:
         self.app = web.Application()
         self.app.router.add_routes(
             [
+                web.head("/", self.on_root),
                 web.post("/oauth/token", self.on_oauth_token),
                 web.post("/oauth/authorize", self.on_oauth_authorize),
                 web.get(
@@ -59,6 +60,8 @@ class Uplink:
         self.redirect = None
         self.systems = {}
         self.requests = defaultdict(int)
+        self.invalid_parameters = set()
+        self.settings = []
         self.tokens = {}
         self.counter = 0
 
@@ -88,6 +91,10 @@ class Uplink:
         await self.runner.cleanup()
         await self.app.shutdown()
 
+    async def on_root(self, request):
+        self.requests_update("on_root")
+        return web.Response()
+
     @oauth_error_response
     async def on_oauth_token(self, request):
         self.requests_update("on_oauth_token")
@@ -153,6 +160,14 @@ class Uplink:
     def add_parameter(self, systemid, parameter):
         self.systems[systemid].parameters[parameter["name"]] = parameter
 
+    def add_missing_parameter(self, systemid, parameter_id):
+        """Known parameter id that is left out of responses"""
+        self.systems[systemid].parameters[str(parameter_id)] = None
+
+    def add_invalid_parameter(self, systemid, parameter_id):
+        """Parameter id that makes the whole request fail"""
+        self.invalid_parameters.add((systemid, str(parameter_id)))
+
     def add_notification(self, systemid, notification):
         self.systems[systemid].notifications[
             notification["notificationId"]
@@ -194,9 +209,14 @@ class Uplink:
 
         systemid = int(request.match_info["systemId"])
         parameters = request.query.getall("parameterIds")
-        return web.json_response(
-            [self.systems[systemid].parameters[str(p)] for p in parameters]
-        )
+        for p in parameters:
+            if (systemid, p) in self.invalid_parameters:
+                return web.json_response(
+                    {"errorCode": 18, "message": "Unknown parameter id."}, status=400
+                )
+
+        data = [self.systems[systemid].parameters[str(p)] for p in parameters]
+        return web.json_response([p for p in data if p is not None])
 
     async def on_put_parameters(self, request):
         self.requests_update("on_put_parameters")
@@ -205,14 +225,14 @@ class Uplink:
 
         systemid = int(request.match_info["systemId"])
         data = await request.json()
+        self.settings.append(data["settings"])
         response = []
 
-        for key in data["settings"].keys():
-            response.append(
-                {
-                    "status": "DONE",
-                    "parameter": self.systems[systemid].parameters[str(key)],
-                }
-            )
+        parameters = self.systems[systemid].parameters
+        for key, value in data["settings"].items():
+            parameter = parameters[str(key)]
+            response.append({"status": "DONE", "parameter": parameter})
+            if parameter:
+                parameters[str(key)] = dict(parameter, rawValue=value)
 
         return web.json_response(response)
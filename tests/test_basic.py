@@ -1,8 +1,10 @@
 import logging
 import pytest
 import nibeuplink
+import aiohttp
 import asyncio
 import fake_uplink
+from nibeuplink.exceptions import UplinkException, UplinkResponseException
 from datetime import datetime, timedelta
 
 logging.basicConfig(level=logging.DEBUG)
@@ -50,11 +52,27 @@ async def default_uplink(loop, request, session, server):
         session=session,
         base=server.base,
         throttle=0,
+        retry=nibeuplink.RetryPolicy(attempts=1),
     )
 
     yield uplink
 
 
+class FakeClock:
+    """Clock for caches and limiters, set by the test."""
+
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
 @pytest.fixture
 async def uplink_with_data(loop, uplink, server, session):
 
@@ -235,6 +253,47 @@ async def test_token_refresh(server, uplink_with_data):
     assert server.requests["on_oauth_token"] == on_oauth_token + 1
 
 
+async def test_session_warmup(server):
+    session = nibeuplink.UplinkSession(
+        DEFAULT_CLIENT_ID,
+        DEFAULT_CLIENT_SECRET,
+        server.redirect,
+        scope=DEFAULT_SCOPE,
+        base=server.base,
+        limit=2,
+        warmup=True,
+    )
+    async with session:
+        assert session.session.connector.limit == 2
+        assert server.requests["on_root"] == 1
+
+
+async def test_token_refresh_concurrent(server, session):
+    await session.get_access_token(DEFAULT_CODE)
+    server.add_system(DEFAULT_SYSTEMID)
+
+    on_oauth_token = server.requests["on_oauth_token"]
+    server.expire_tokens()
+
+    url = "{}/api/v1/systems/{}/notifications".format(server.base, DEFAULT_SYSTEMID)
+    results = await asyncio.gather(*[session.request("GET", url) for _ in range(3)])
+    assert all(result["objects"] == [] for result in results)
+    assert server.requests["on_oauth_token"] == on_oauth_token + 1
+    assert server.requests["on_notifications"] == 6
+
+
+async def test_token_refresh_ahead(server, session, uplink_with_data):
+    session.refresh_margin = 300
+    session.refresh_jitter = 0
+    await session.refresh_access_token()
+
+    on_oauth_token = server.requests["on_oauth_token"]
+    parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert parameter["displayValue"] == "100 Unit"
+    assert server.requests["on_oauth_token"] == on_oauth_token + 1
+    assert server.requests["on_get_parameters"] == 1
+
+
 async def test_get_parameter(uplink_with_data):
 
     parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
@@ -256,6 +315,33 @@ async def test_put_parameter(uplink_with_data):
     assert status == "DONE"
 
 
+async def test_put_parameter_cached(uplink_with_data):
+    """Written parameters are read again instead of from cache"""
+    uplink_with_data.cache = nibeuplink.ParameterCache(ttl=30)
+
+    parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert parameter["rawValue"] == 100
+
+    status = await uplink_with_data.put_parameter(DEFAULT_SYSTEMID, 100, 5)
+    assert status == "DONE"
+
+    parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert parameter["rawValue"] == 5
+
+
+async def test_put_parameter_merged(uplink_with_data, server):
+    """Concurrent writes are merged, keeping last value"""
+    status = await asyncio.gather(
+        uplink_with_data.put_parameter(DEFAULT_SYSTEMID, 100, "hello"),
+        uplink_with_data.put_parameter(DEFAULT_SYSTEMID, 120, "world"),
+        uplink_with_data.put_parameter(DEFAULT_SYSTEMID, "100", "again"),
+    )
+
+    assert status == ["DONE", "DONE", "DONE"]
+    assert server.requests["on_put_parameters"] == 1
+    assert server.settings == [{"100": "again", "120": "world"}]
+
+
 async def test_parameters_unit(uplink_with_data):
 
     parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
@@ -304,6 +390,209 @@ async def test_parameters(session, uplink, server, count):
     assert server.requests["on_get_parameters"] == int((len(parameterids) + 14) / 15)
 
 
+async def test_parameters_duplicate(uplink_with_data, server):
+    """Concurrent requests for same parameter share a slot"""
+    parameters = await asyncio.gather(
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, "100"),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 120),
+    )
+    assert parameters[0] is parameters[1]
+    assert parameters[2]["displayValue"] == "120 Units"
+    assert server.requests["on_get_parameters"] == 1
+
+
+async def test_parameters_cache(uplink_with_data, server, clock):
+    """Cached parameters are served directly, stale ones refreshed"""
+    uplink_with_data.cache = nibeuplink.ParameterCache(
+        ttl=10, stale=10, ttls={120: 100}, clock=clock
+    )
+
+    await asyncio.gather(
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 120),
+    )
+    assert server.requests["on_get_parameters"] == 1
+
+    parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert parameter["value"] == 100.0
+    assert server.requests["on_get_parameters"] == 1
+
+    # stale value returned while refreshed in background
+    clock.time = 15.0
+    parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert parameter["value"] == 100.0
+    await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 120)
+    await asyncio.sleep(0)
+    while uplink_with_data.dispatchers:
+        await asyncio.sleep(0.01)
+    assert server.requests["on_get_parameters"] == 2
+
+    # expired value fetched directly
+    clock.time = 50.0
+    await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert server.requests["on_get_parameters"] == 3
+
+
+async def test_parameters_missing(uplink_with_data, server, clock):
+    """Parameters repeatedly missing are excluded for a while"""
+    uplink_with_data.missing = nibeuplink.NegativeCache(
+        threshold=2, period=10, clock=clock
+    )
+    server.add_missing_parameter(DEFAULT_SYSTEMID, 130)
+
+    for _ in range(3):
+        parameters = await asyncio.gather(
+            uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100),
+            uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 130),
+        )
+        assert parameters[1] is None
+
+    assert server.requests["on_get_parameters"] == 3
+    assert len(uplink_with_data.missing) == 1
+
+    assert await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 130) is None
+    assert server.requests["on_get_parameters"] == 3
+
+    # probed again after period
+    clock.time = 20.0
+    assert await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 130) is None
+    assert server.requests["on_get_parameters"] == 4
+    assert await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 130) is None
+    assert server.requests["on_get_parameters"] == 4
+
+
+async def test_parameters_invalid(uplink_with_data, server):
+    """Invalid parameter is found by bisection and only fails itself"""
+    server.add_invalid_parameter(DEFAULT_SYSTEMID, 140)
+
+    results = await asyncio.gather(
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 120),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, "onehundredtwenty"),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 140),
+        return_exceptions=True,
+    )
+    assert results[0]["displayValue"] == "100 Unit"
+    assert results[1]["displayValue"] == "120 Units"
+    assert results[2]["displayValue"] == "120 Units"
+    assert isinstance(results[3], UplinkResponseException)
+    assert results[3].code == 18
+    assert server.requests["on_get_parameters"] == 5
+
+    with pytest.raises(UplinkResponseException):
+        await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 140)
+    assert server.requests["on_get_parameters"] == 5
+
+
+async def test_parameters_linger(uplink_with_data, server):
+    """Requests arriving within linger time share a batch"""
+    uplink_with_data.linger = 0.2
+    uplink_with_data.fill = 2
+
+    async def delayed(parameter_id):
+        await asyncio.sleep(0.05)
+        return await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, parameter_id)
+
+    start = datetime.now()
+    await asyncio.gather(
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100), delayed(120),
+    )
+    assert (datetime.now() - start) < timedelta(seconds=0.2)
+    assert server.requests["on_get_parameters"] == 1
+
+    start = datetime.now()
+    await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert (datetime.now() - start) >= timedelta(seconds=0.2)
+    assert server.requests["on_get_parameters"] == 2
+
+    assert uplink_with_data.batch_fill_ratio == 3 / 30
+
+
+async def test_parameters_cancelled(uplink_with_data, server):
+    """Cancelled requests are removed from queue"""
+    uplink_with_data.linger = 0.1
+
+    shared = asyncio.ensure_future(
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    )
+    cancelled = [
+        asyncio.ensure_future(uplink_with_data.get_parameter(DEFAULT_SYSTEMID, p))
+        for p in (100, 120)
+    ]
+    await asyncio.sleep(0)
+    for task in cancelled:
+        task.cancel()
+    await asyncio.sleep(0)
+    assert list(uplink_with_data.requests[DEFAULT_SYSTEMID]) == ["100"]
+
+    parameter = await shared
+    assert parameter["displayValue"] == "100 Unit"
+    await asyncio.sleep(0)
+    assert DEFAULT_SYSTEMID not in uplink_with_data.requests
+    assert server.requests["on_get_parameters"] == 1
+
+
+async def test_parameters_timeout(uplink_with_data, server):
+    """Requests timing out are never sent"""
+    uplink_with_data.linger = 0.2
+
+    with pytest.raises(asyncio.TimeoutError):
+        await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100, timeout=0.05)
+
+    await asyncio.sleep(0.3)
+    assert not uplink_with_data.requests
+    assert server.requests["on_get_parameters"] == 0
+
+
+async def test_parameters_error(uplink_with_data):
+    """Failed batch is reported to every waiter in that batch"""
+    results = await asyncio.gather(
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100),
+        uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 999),
+        return_exceptions=True,
+    )
+    assert all(isinstance(r, UplinkException) for r in results)
+    assert not uplink_with_data.dispatchers
+
+    parameter = await uplink_with_data.get_parameter(DEFAULT_SYSTEMID, 100)
+    assert parameter["displayValue"] == "100 Unit"
+
+
+@pytest.mark.parametrize("count", [1, 15, 16])
+async def test_get_parameters(session, uplink, server, count):
+
+    await session.get_access_token("goodcode")
+
+    server.add_system(DEFAULT_SYSTEMID)
+    parameterids = range(100, 100 + count)
+
+    for index in parameterids:
+        server.add_parameter(
+            DEFAULT_SYSTEMID,
+            {
+                "parameterId": index,
+                "displayValue": "{} Unit".format(index),
+                "name": str(index),
+                "title": "Paramter Title",
+                "unit": "Unit",
+                "designation": "Designation",
+                "rawValue": index,
+            },
+        )
+    server.add_missing_parameter(DEFAULT_SYSTEMID, 99)
+
+    parameters = await uplink.get_parameters(
+        DEFAULT_SYSTEMID, [99, *parameterids, "100"]
+    )
+
+    assert set(parameters) == {*parameterids, "100"}
+    for index in parameterids:
+        assert parameters[index]["value"] == index
+    assert parameters["100"] is parameters[100]
+    assert server.requests["on_get_parameters"] == int((count + 1 + 14) / 15)
+
+
 async def test_throttle_initial():
     """No inital delay"""
     start = datetime.now()
@@ -324,3 +613,105 @@ async def test_throttle_time_from_finish():
     now = datetime.now()
     assert (now - start) > timedelta(seconds=2)
     assert (now - start) < timedelta(seconds=3)
+
+
+async def test_throttle_time_from_start():
+    """Time counted from start of with block"""
+    start = datetime.now()
+    throttle = nibeuplink.uplink.Throttle(timedelta(seconds=1), from_start=True)
+    async with throttle:
+        await asyncio.sleep(0.5)
+    async with throttle:
+        pass
+    now = datetime.now()
+    assert (now - start) > timedelta(seconds=1)
+    assert (now - start) < timedelta(seconds=1.5)
+
+
+async def test_token_bucket_burst():
+    """Burst of requests allowed after idle, then spaced by rate"""
+    start = datetime.now()
+    bucket = nibeuplink.TokenBucket(rate=2, burst=3)
+    for _ in range(3):
+        async with bucket:
+            pass
+    assert (datetime.now() - start) < timedelta(seconds=0.4)
+
+    async with bucket:
+        pass
+    now = datetime.now()
+    assert (now - start) > timedelta(seconds=0.4)
+    assert (now - start) < timedelta(seconds=1)
+
+
+async def test_token_bucket_clock(clock):
+    """Tokens are refilled from supplied clock"""
+    bucket = nibeuplink.TokenBucket(rate=1, burst=2, clock=clock)
+    await bucket.acquire()
+    await bucket.acquire()
+    assert bucket._tokens == 0
+
+    clock.time = 10.0
+    bucket._refill()
+    assert bucket._tokens == 2
+
+
+def _rate_limit_error(headers=None):
+    try:
+        try:
+            raise aiohttp.ClientResponseError(
+                None, (), status=429, headers=headers or {}
+            )
+        except aiohttp.ClientResponseError as e:
+            raise UplinkResponseException(28, {}) from e
+    except UplinkResponseException as e:
+        return e
+
+
+async def test_token_bucket_backoff(clock):
+    """Rate is reduced on rate limit and slowly restored"""
+    bucket = nibeuplink.TokenBucket(rate=1, burst=1, clock=clock, recovery=0.25)
+
+    error = _rate_limit_error()
+    await bucket.__aexit__(type(error), error, None)
+    assert bucket.rate == 0.5
+    await bucket.__aexit__(type(error), error, None)
+    assert bucket.rate == 0.25
+
+    for _ in range(2):
+        await bucket.__aexit__(None, None, None)
+    assert bucket.rate == 0.75
+
+    for _ in range(10):
+        await bucket.__aexit__(None, None, None)
+    assert bucket.rate == 1
+
+
+async def test_token_bucket_retry_after(clock):
+    """Retry-After header delays next token"""
+    bucket = nibeuplink.TokenBucket(rate=1, burst=1, clock=clock)
+
+    error = _rate_limit_error({"Retry-After": "10"})
+    await bucket.__aexit__(type(error), error, None)
+    assert bucket.rate == 0.5
+
+    clock.time = 5.0
+    bucket._refill()
+    assert bucket._tokens < 0
+
+    clock.time = 10.0
+    bucket._refill()
+    assert bucket._tokens == 0
+
+
+def test_retry_after_date():
+    """Retry-After dates are relative to now, also without zone"""
+    get_retry_after = nibeuplink.limiter.get_retry_after
+    for value in ("Wed, 21 Oct 2015 07:28:00 GMT", "Wed, 21 Oct 2015 07:28:00 -0000"):
+        assert get_retry_after(_rate_limit_error({"Retry-After": value})) == 0.0
+
+    value = (datetime.utcnow() + timedelta(seconds=60)).strftime(
+        "%a, %d %b %Y %H:%M:%S -0000"
+    )
+    delay = get_retry_after(_rate_limit_error({"Retry-After": value}))
+    assert 50 < delay <= 60
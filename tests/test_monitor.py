@@ -1,6 +1,7 @@
 import pytest
 import nibeuplink
 import asyncio
+import heapq
 import asynctest
 
 PARAMETERS = {
@@ -14,10 +15,12 @@ PARAMETERS = {
 async def uplink_mock(loop):
     uplink = asynctest.Mock(nibeuplink.Uplink)
 
-    def get_parameter(system_id, parameter_id):
-        return PARAMETERS[parameter_id]
+    def get_parameters(system_id, parameter_ids, priority=None):
+        return {
+            parameter_id: PARAMETERS[parameter_id] for parameter_id in parameter_ids
+        }
 
-    uplink.get_parameter.side_effect = get_parameter
+    uplink.get_parameters.side_effect = get_parameters
     return uplink
 
 
@@ -90,6 +93,386 @@ async def test_monitor_removed_callback_all(uplink_mock):
 
     await monitor.run_once()
 
-    uplink_mock.get_parameter.assert_not_called()
+    uplink_mock.get_parameters.assert_not_called()
     callback_a1.assert_not_called()
     callback_a2.assert_not_called()
+
+
+async def test_monitor_intervals(uplink_mock):
+    now = 0.0
+    monitor = nibeuplink.Monitor(uplink_mock, chunks=2, clock=lambda: now)
+
+    callback = asynctest.Mock()
+    monitor.add_callback(callback)
+
+    monitor.add(1, "a", interval=30)
+    monitor.add(1, "b", interval=1800)
+    monitor.add(1, "c", interval=30)
+
+    async def poll():
+        uplink_mock.get_parameters.reset_mock()
+        await monitor.run_once()
+        if not uplink_mock.get_parameters.called:
+            return None
+        return uplink_mock.get_parameters.call_args[0][1]
+
+    assert await poll() == ["a", "b"]
+    assert await poll() == ["c", "a"]
+    assert await poll() is None
+    assert monitor.next_due() == 30
+
+    now = 30.0
+    assert await poll() == ["c", "a"]
+    assert await poll() is None
+
+    now = 60.0
+    assert await poll() == ["c", "a"]
+
+    now = 1800.0
+    assert await poll() == ["c", "a"]
+    assert await poll() == ["b", "c"]
+
+    monitor.remove(1, "a")
+    monitor.remove(1, "c")
+    assert monitor.next_due() == 3600
+
+
+async def test_monitor_delta(uplink_mock):
+    now = 0.0
+    values = {"a": 10, "b": 20, "c": "on"}
+
+    def get_parameters(system_id, parameter_ids, priority=None):
+        return {
+            parameter_id: {"name": parameter_id, "rawValue": values[parameter_id]}
+            for parameter_id in parameter_ids
+        }
+
+    uplink_mock.get_parameters.side_effect = get_parameters
+    monitor = nibeuplink.Monitor(uplink_mock, refresh=600, clock=lambda: now)
+
+    callback = asynctest.Mock()
+    callback_delta = asynctest.Mock()
+    monitor.add_callback(callback)
+    monitor.add_callback(callback_delta, delta=True)
+
+    monitor.add(1, "a")
+    monitor.add(1, "b")
+    monitor.add(1, "c")
+    monitor.set_deadband(1, "b", 5)
+
+    def delivered():
+        result = set(callback_delta.call_args[0][1]) if callback_delta.called else set()
+        callback_delta.reset_mock()
+        return result
+
+    await monitor.run_once()
+    assert delivered() == {"a", "b", "c"}
+
+    await monitor.run_once()
+    assert delivered() == set()
+    assert len(callback.call_args[0][1]) == 3
+
+    values.update(a=11, b=24, c="off")
+    await monitor.run_once()
+    assert delivered() == {"a", "c"}
+
+    # drift is compared against the last delivered value
+    values.update(b=26)
+    await monitor.run_once()
+    assert delivered() == {"b"}
+
+    now = 600.0
+    await monitor.run_once()
+    assert delivered() == {"a", "b", "c"}
+
+    # new delta callback gets all values, without resending to others
+    callback_new = asynctest.Mock()
+    monitor.add_callback(callback_new, delta=True)
+    await monitor.run_once()
+    assert set(callback_new.call_args[0][1]) == {"a", "b", "c"}
+    assert delivered() == set()
+
+
+async def test_monitor_postpone(uplink_mock):
+    now = 0.0
+    monitor = nibeuplink.Monitor(uplink_mock, clock=lambda: now)
+    monitor.add(1, 40004, interval=30)
+    monitor.add(1, "a", interval=60)
+    assert monitor.next_due() == 0
+
+    # parameter sets are keyed by name, but matched by parameter id too
+    monitor.postpone(1, {"40004": {"name": "40004", "parameterId": 40004}})
+    monitor.postpone(1, ["a"])
+    assert monitor.next_due() == 30
+
+
+async def test_monitor_scoped_callbacks(uplink_mock):
+    monitor = nibeuplink.Monitor(uplink_mock)
+
+    callback_all = asynctest.Mock()
+    callback_system = asynctest.Mock()
+    callback_parameter = asynctest.Mock()
+    monitor.add_callback(callback_all)
+    monitor.add_callback(callback_system, system_id=2)
+    monitor.add_callback(callback_parameter, parameter_ids=["b", "c"])
+
+    monitor.add(1, "a")
+    monitor.add(1, "b")
+    monitor.add(2, "c")
+
+    await monitor.run_once()
+    callback_all.assert_called_once_with(
+        1, {"a": PARAMETERS["a"], "b": PARAMETERS["b"]}
+    )
+    callback_system.assert_not_called()
+    callback_parameter.assert_called_once_with(1, {"b": PARAMETERS["b"]})
+
+    callback_all.reset_mock()
+    callback_parameter.reset_mock()
+
+    await monitor.run_once()
+    callback_all.assert_called_once_with(2, {"c": PARAMETERS["c"]})
+    callback_system.assert_called_once_with(2, {"c": PARAMETERS["c"]})
+    callback_parameter.assert_called_once_with(2, {"c": PARAMETERS["c"]})
+
+    monitor.del_callback(callback_parameter)
+    callback_parameter.reset_mock()
+
+    await monitor.run_once()
+    callback_parameter.assert_not_called()
+
+
+@pytest.fixture
+async def async_callback(loop):
+    release = asyncio.Event()
+    received = []
+
+    async def callback(system_id, parameter_set):
+        await release.wait()
+        received.append((system_id, set(parameter_set)))
+
+    callback.release = release
+    callback.received = received
+    return callback
+
+
+async def test_monitor_async_drop_oldest(uplink_mock, async_callback):
+    monitor = nibeuplink.Monitor(uplink_mock)
+    monitor.add_callback(async_callback, maxsize=1)
+    monitor.add(1, "a")
+    monitor.add(2, "b")
+    monitor.add(3, "c")
+
+    # first set is picked up by the callback, which then waits
+    await monitor.run_once()
+    await asyncio.sleep(0)
+    await monitor.run_once()
+    await monitor.run_once()
+
+    queue = monitor.get_queue(async_callback)
+    assert queue.depth == 1
+    assert queue.dropped == 1
+    assert queue.lag >= 0
+
+    async_callback.release.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert async_callback.received == [(1, {"a"}), (3, {"c"})]
+    assert queue.depth == 0
+    monitor.close()
+
+
+async def test_monitor_async_coalesce(uplink_mock, async_callback):
+    monitor = nibeuplink.Monitor(uplink_mock, chunks=1)
+    monitor.add_callback(async_callback, maxsize=1, overflow="coalesce")
+    monitor.add(1, "a")
+    monitor.add(1, "b")
+    monitor.add(1, "c")
+
+    await monitor.run_once()
+    await asyncio.sleep(0)
+    await monitor.run_once()
+    await monitor.run_once()
+    assert monitor.get_queue(async_callback).coalesced == 1
+
+    async_callback.release.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert async_callback.received == [(1, {"a"}), (1, {"b", "c"})]
+    monitor.close()
+
+
+async def test_monitor_async_block(uplink_mock, async_callback):
+    monitor = nibeuplink.Monitor(uplink_mock)
+    monitor.add_callback(async_callback, maxsize=1, overflow="block")
+    monitor.add(1, "a")
+    monitor.add(2, "b")
+    monitor.add(3, "c")
+
+    await monitor.run_once()
+    await asyncio.sleep(0)
+    await monitor.run_once()
+
+    task = asyncio.ensure_future(monitor.run_once())
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    async_callback.release.set()
+    await asyncio.wait_for(task, 1)
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert async_callback.received == [(1, {"a"}), (2, {"b"}), (3, {"c"})]
+
+    monitor.del_callback(async_callback)
+    assert monitor.get_queue(async_callback) is None
+
+
+async def test_monitor_async_block_deleted(uplink_mock, async_callback):
+    monitor = nibeuplink.Monitor(uplink_mock)
+    monitor.add_callback(async_callback, maxsize=1, overflow="block")
+    monitor.add(1, "a")
+    monitor.add(2, "b")
+    monitor.add(3, "c")
+
+    await monitor.run_once()
+    await asyncio.sleep(0)
+    await monitor.run_once()
+
+    queue = monitor.get_queue(async_callback)
+    task = asyncio.ensure_future(monitor.run_once())
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    # blocked put gives up, and the callback task is not restarted
+    monitor.del_callback(async_callback)
+    await asyncio.wait_for(task, 1)
+    assert queue.depth == 0
+    assert queue._task is None
+
+    async_callback.release.set()
+    await monitor.run_once()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert async_callback.received == []
+
+
+async def test_monitor_async_block_other_deleted(uplink_mock, async_callback):
+    monitor = nibeuplink.Monitor(uplink_mock)
+    other_async = asynctest.CoroutineMock()
+    other_sync = asynctest.Mock()
+    monitor.add_callback(async_callback, maxsize=1, overflow="block")
+    monitor.add_callback(other_async)
+    monitor.add_callback(other_sync)
+    monitor.add(1, "a")
+    monitor.add(2, "b")
+    monitor.add(3, "c")
+
+    await monitor.run_once()
+    await asyncio.sleep(0)
+    await monitor.run_once()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    other_async.reset_mock()
+    other_sync.reset_mock()
+
+    task = asyncio.ensure_future(monitor.run_once())
+    await asyncio.sleep(0)
+    assert not task.done()
+
+    # callbacks removed while blocked on an earlier queue are skipped
+    monitor.del_callback(other_async)
+    monitor.del_callback(other_sync)
+    async_callback.release.set()
+    await asyncio.wait_for(task, 1)
+    other_async.assert_not_called()
+    other_sync.assert_not_called()
+    monitor.close()
+
+
+async def test_monitor_call_callbacks_sync(uplink_mock, async_callback):
+    monitor = nibeuplink.Monitor(uplink_mock)
+    callback = asynctest.Mock()
+    monitor.add_callback(callback)
+    monitor.add_callback(async_callback, maxsize=1, overflow="block")
+
+    # synchronous callers can not wait, so blocking queues grow instead
+    monitor.call_callbacks(1, [PARAMETERS["a"], None])
+    monitor.call_parameters(2, {"b": PARAMETERS["b"]})
+    callback.assert_called_with(2, {"b": PARAMETERS["b"]})
+    assert monitor.get_queue(async_callback).depth == 2
+
+    async_callback.release.set()
+    for _ in range(5):
+        await asyncio.sleep(0)
+    assert async_callback.received == [(1, {"a"}), (2, {"b"})]
+    monitor.close()
+
+
+async def test_monitor_run_wakeup(uplink_mock):
+    monitor = nibeuplink.Monitor(uplink_mock, delay=0.01)
+    monitor.add(1, "a", interval=1800)
+
+    task = asyncio.ensure_future(monitor.run())
+    try:
+        await asyncio.wait_for(_called(uplink_mock.get_parameters), 1)
+        uplink_mock.get_parameters.reset_mock()
+
+        # new parameter is due at once, even though run waits for "a"
+        monitor.add(1, "b", interval=30)
+        await asyncio.wait_for(_called(uplink_mock.get_parameters), 1)
+        assert "b" in uplink_mock.get_parameters.call_args[0][1]
+    finally:
+        task.cancel()
+
+
+async def _called(mock):
+    while not mock.called:
+        await asyncio.sleep(0.01)
+
+
+class CountingHeapq:
+    """Stand in for heapq counting the heap operations made."""
+
+    def __init__(self):
+        self.operations = 0
+
+    def heappush(self, heap, item):
+        self.operations += 1
+        heapq.heappush(heap, item)
+
+    def heappop(self, heap):
+        self.operations += 1
+        return heapq.heappop(heap)
+
+
+def _operations_per_step(monkeypatch, uplink, systems, parameters):
+    monitor = nibeuplink.Monitor(uplink, clock=lambda: 0.0)
+    for parameter_id in range(parameters):
+        for system_id in range(systems):
+            monitor.add(system_id, parameter_id)
+
+    counting = CountingHeapq()
+    monkeypatch.setattr(nibeuplink.monitor, "heapq", counting)
+
+    # two full rounds, to include the skipping of replaced entries
+    steps = 2 * systems * parameters // 15
+    polled = set()
+    for _ in range(steps):
+        system_id, parameter_ids = monitor._pop_due()
+        assert len(parameter_ids) == 15
+        polled.update((system_id, parameter_id) for parameter_id in parameter_ids)
+
+    assert len(polled) == systems * parameters
+    assert len(monitor._systems) < 2 * systems
+    monkeypatch.undo()
+    return counting.operations / steps
+
+
+async def test_monitor_scale(uplink_mock, monkeypatch):
+    """Scheduling work per batch stays O(batch) with many subscriptions"""
+    small = _operations_per_step(monkeypatch, uplink_mock, 4, 255)
+    large = _operations_per_step(monkeypatch, uplink_mock, 400, 255)
+
+    # a pop and a push per parameter, and a few for the system heads
+    assert large <= 2 * 15 + 4
+    assert large <= small + 1
@@ -0,0 +1,66 @@
+import asyncio
+
+from nibeuplink.scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_READ,
+    PRIORITY_WRITE,
+    PriorityScheduler,
+)
+
+
+async def _run(scheduler, priority, order):
+    async with scheduler.slot(priority):
+        order.append(priority)
+
+
+async def test_scheduler_priority(loop):
+    scheduler = PriorityScheduler(1)
+    order = []
+
+    await scheduler.acquire()
+    tasks = [
+        asyncio.ensure_future(_run(scheduler, priority, order))
+        for priority in (PRIORITY_BACKGROUND, PRIORITY_READ, PRIORITY_WRITE)
+    ]
+    await asyncio.sleep(0)
+    assert scheduler.depth == {
+        PRIORITY_WRITE: 1,
+        PRIORITY_READ: 1,
+        PRIORITY_BACKGROUND: 1,
+    }
+
+    scheduler.release()
+    await asyncio.gather(*tasks)
+    assert order == [PRIORITY_WRITE, PRIORITY_READ, PRIORITY_BACKGROUND]
+
+
+async def test_scheduler_aging(loop):
+    scheduler = PriorityScheduler(1, aging=0.01)
+    order = []
+
+    await scheduler.acquire()
+    background = asyncio.ensure_future(_run(scheduler, PRIORITY_BACKGROUND, order))
+    await asyncio.sleep(0.1)
+    write = asyncio.ensure_future(_run(scheduler, PRIORITY_WRITE, order))
+    await asyncio.sleep(0)
+
+    scheduler.release()
+    await asyncio.gather(background, write)
+    assert order == [PRIORITY_BACKGROUND, PRIORITY_WRITE]
+
+
+async def test_scheduler_cancelled(loop):
+    scheduler = PriorityScheduler(1)
+    order = []
+
+    await scheduler.acquire()
+    cancelled = asyncio.ensure_future(_run(scheduler, PRIORITY_WRITE, order))
+    waiting = asyncio.ensure_future(_run(scheduler, PRIORITY_READ, order))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.depth[PRIORITY_WRITE] == 0
+
+    scheduler.release()
+    await waiting
+    assert order == [PRIORITY_READ]
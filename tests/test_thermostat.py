@@ -0,0 +1,93 @@
+import asyncio
+
+import aiohttp
+import pytest
+import nibeuplink
+import asynctest
+
+from nibeuplink.exceptions import UplinkException
+from nibeuplink.typing import SetThermostatModel
+
+
+def _thermostat(external_id, actual):
+    return SetThermostatModel(
+        externalId=external_id,
+        name="name{}".format(external_id),
+        actualTemp=actual,
+        targetTemp=None,
+        valvePosition=None,
+        climateSystems=[1],
+    )
+
+
+@pytest.fixture
+async def uplink_mock(loop):
+    return asynctest.Mock(nibeuplink.Uplink)
+
+
+async def test_publisher_latest(uplink_mock):
+    publisher = nibeuplink.ThermostatPublisher(uplink_mock, 1)
+
+    publisher.update(_thermostat(1, 200))
+    publisher.update(_thermostat(1, 210))
+    publisher.update(_thermostat(2, 220))
+    await publisher.flush()
+
+    assert uplink_mock.post_smarthome_thermostats.call_count == 2
+    uplink_mock.post_smarthome_thermostats.assert_any_call(1, _thermostat(1, 210))
+    uplink_mock.post_smarthome_thermostats.assert_any_call(1, _thermostat(2, 220))
+
+    uplink_mock.post_smarthome_thermostats.reset_mock()
+    await publisher.flush()
+    uplink_mock.post_smarthome_thermostats.assert_not_called()
+
+
+async def test_publisher_deadband(uplink_mock):
+    publisher = nibeuplink.ThermostatPublisher(uplink_mock, 1, deadband=5)
+
+    publisher.update(_thermostat(1, 200))
+    await publisher.flush()
+    uplink_mock.post_smarthome_thermostats.reset_mock()
+
+    publisher.update(_thermostat(1, 204))
+    await publisher.flush()
+    uplink_mock.post_smarthome_thermostats.assert_not_called()
+
+    publisher.update(_thermostat(1, 195))
+    await publisher.flush()
+    uplink_mock.post_smarthome_thermostats.assert_called_once_with(
+        1, _thermostat(1, 195)
+    )
+
+
+async def test_publisher_failed(uplink_mock):
+    publisher = nibeuplink.ThermostatPublisher(uplink_mock, 1)
+    uplink_mock.post_smarthome_thermostats.side_effect = UplinkException("error")
+
+    publisher.update(_thermostat(1, 200))
+    publisher.update(_thermostat(2, 200))
+    with pytest.raises(UplinkException):
+        await publisher.flush()
+
+    uplink_mock.post_smarthome_thermostats.side_effect = None
+    uplink_mock.post_smarthome_thermostats.reset_mock()
+    await publisher.flush()
+    assert uplink_mock.post_smarthome_thermostats.call_count == 2
+
+
+async def test_publisher_run_error(uplink_mock):
+    publisher = nibeuplink.ThermostatPublisher(uplink_mock, 1, interval=0.01)
+    uplink_mock.post_smarthome_thermostats.side_effect = [
+        aiohttp.ServerDisconnectedError(),
+        asyncio.TimeoutError(),
+        None,
+    ]
+
+    publisher.update(_thermostat(1, 200))
+    task = asyncio.ensure_future(publisher.run())
+    try:
+        while uplink_mock.post_smarthome_thermostats.call_count < 3:
+            assert not task.done()
+            await asyncio.sleep(0.01)
+    finally:
+        task.cancel()
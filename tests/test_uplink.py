@@ -1,8 +1,14 @@
 """Test the uplink class."""
+import asyncio
+from unittest.mock import Mock
+
+import aiohttp
 from aioresponses import aioresponses, CallbackResult
 
-from pytest import fixture
+from pytest import fixture, raises
 
+from nibeuplink.exceptions import UplinkException
+from nibeuplink.retry import RetryBudget, RetryPolicy
 from nibeuplink.session import UplinkSession
 from nibeuplink.typing import SetThermostatModel
 from nibeuplink.uplink import Uplink
@@ -52,7 +58,7 @@ async def uplink_fixture(aioresp: aioresponses):
     async with UplinkSession(
         MOCK_CLIENT_ID, MOCK_CLIENT_SECRET, MOCK_REDIRECT_URI
     ) as session:
-        uplink = Uplink(session)
+        uplink = Uplink(session, retry=RetryPolicy(attempts=1))
         yield uplink
 
 
@@ -93,3 +99,215 @@ async def test_post_smarthome_thermostats(aioresp: aioresponses, uplink: Uplink)
         climateSystems=[1],
     )
     await uplink.post_smarthome_thermostats(MOCK_SYSTEMID, thermostat)
+
+
+async def test_concurrency(aioresp: aioresponses, uplink: Uplink):
+    uplink = Uplink(uplink.session, throttle=0, concurrency=2)
+    active = 0
+    peak = 0
+
+    async def _callback(url, **kwargs):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.1)
+        active -= 1
+        return CallbackResult(method="GET", payload=MOCK_SYSTEM_1)
+
+    for system_id in (1, 2, 3):
+        aioresp.add(
+            f"https://api.nibeuplink.com/api/v1/systems/{system_id}",
+            method="GET",
+            callback=_callback,
+        )
+
+    await asyncio.gather(*[uplink.get_system(system_id) for system_id in (1, 2, 3)])
+    assert peak == 2
+
+
+async def test_get_system_shared(aioresp: aioresponses, uplink: Uplink):
+    aioresp.add(
+        f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}",
+        method="GET",
+        payload=MOCK_SYSTEM_1,
+    )
+    results = await asyncio.gather(
+        uplink.get_system(MOCK_SYSTEMID), uplink.get_system(MOCK_SYSTEMID)
+    )
+    assert results == [MOCK_SYSTEM_1, MOCK_SYSTEM_1]
+    assert not uplink.results
+
+
+async def test_get_system_result_ttl(aioresp: aioresponses, uplink: Uplink):
+    uplink.result_ttl = 10
+    aioresp.add(
+        f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}",
+        method="GET",
+        payload=MOCK_SYSTEM_1,
+    )
+    assert await uplink.get_system(MOCK_SYSTEMID) == MOCK_SYSTEM_1
+    assert await uplink.get_system(MOCK_SYSTEMID) == MOCK_SYSTEM_1
+
+
+async def test_get_system_result_ttl_expired(aioresp: aioresponses, uplink: Uplink):
+    uplink = Uplink(
+        uplink.session, throttle=0, result_ttl=10, retry=RetryPolicy(attempts=1)
+    )
+    aioresp.add(
+        f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}",
+        method="GET",
+        payload=MOCK_SYSTEM_1,
+    )
+    assert await uplink.get_system(MOCK_SYSTEMID) == MOCK_SYSTEM_1
+    ((key, (_, value)),) = uplink.results.items()
+    uplink.results[key] = (0.0, value)
+
+    # expired results are dropped when looked up, even if request fails
+    with raises(aiohttp.ClientConnectionError):
+        await uplink.get_system(MOCK_SYSTEMID)
+    assert not uplink.results
+
+
+def _no_jitter(low, high):
+    return 0
+
+
+class CountingLimiter:
+    """Limiter that lets everything through, counting tokens taken."""
+
+    def __init__(self):
+        self.tokens = 0
+
+    async def __aenter__(self):
+        self.tokens += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+async def test_retry_get(aioresp: aioresponses, uplink: Uplink):
+    limiter = CountingLimiter()
+    retry = RetryPolicy(jitter=lambda low, high: 0.1)
+    uplink = Uplink(uplink.session, limiter=limiter, retry=retry)
+    url = f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}"
+    aioresp.get(url, status=503, body="Unavailable", content_type="text/plain")
+    aioresp.get(url, exception=aiohttp.ServerDisconnectedError())
+    aioresp.get(url, payload=MOCK_SYSTEM_1)
+    aioresp.get("https://api.nibeuplink.com/api/v1/systems", payload={"objects": []})
+
+    done = []
+
+    async def get_system():
+        assert await uplink.get_system(MOCK_SYSTEMID) == MOCK_SYSTEM_1
+        done.append("system")
+
+    async def get_systems():
+        await asyncio.sleep(0.05)
+        assert await uplink.get_systems() == []
+        done.append("systems")
+
+    # slot is free while waiting to retry, so other requests can go first
+    await asyncio.gather(get_system(), get_systems())
+    assert done == ["systems", "system"]
+    assert limiter.tokens == 4
+    assert retry.stats == {"retried": 2, "recovered": 1, "succeeded": 1}
+
+
+async def test_retry_get_parameter(aioresp: aioresponses, uplink: Uplink):
+    limiter = CountingLimiter()
+    retry = RetryPolicy(jitter=_no_jitter)
+    uplink = Uplink(uplink.session, limiter=limiter, retry=retry)
+    url = (
+        f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}"
+        "/parameters?parameterIds=100"
+    )
+    parameter = {
+        "parameterId": 100,
+        "name": "100",
+        "displayValue": "1 Unit",
+        "unit": "Unit",
+        "rawValue": 1,
+    }
+    aioresp.get(url, status=502, body="Bad gateway", content_type="text/plain")
+    aioresp.get(url, payload=[parameter])
+
+    assert (await uplink.get_parameter(MOCK_SYSTEMID, 100))["rawValue"] == 1
+    assert limiter.tokens == 2
+    assert retry.stats == {"retried": 1, "recovered": 1}
+
+
+async def test_retry_put(aioresp: aioresponses, uplink: Uplink):
+    retry = RetryPolicy(jitter=_no_jitter)
+    uplink = Uplink(uplink.session, throttle=0, retry=retry)
+    url = f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}/smarthome/mode"
+    connect_error = aiohttp.ClientConnectorError(Mock(), OSError(111, "refused"))
+    aioresp.put(url, exception=connect_error)
+    aioresp.put(url, payload={})
+    aioresp.put(url, status=503, body="Unavailable", content_type="text/plain")
+
+    await uplink.put_smarthome_mode(MOCK_SYSTEMID, "DEFAULT")
+    assert retry.stats == {"retried": 1, "recovered": 1}
+
+    # request may have reached the server, so must not be resent
+    with raises(UplinkException):
+        await uplink.put_smarthome_mode(MOCK_SYSTEMID, "AWAY")
+    assert retry.stats["failed"] == 1
+
+
+async def test_put_parameter_malformed(aioresp: aioresponses, uplink: Uplink):
+    uplink = Uplink(uplink.session, throttle=0, retry=RetryPolicy(attempts=1))
+    url = f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}/parameters"
+    aioresp.put(url, payload=[{"parameter": None}])
+    aioresp.put(url, body="Done", content_type="text/plain")
+
+    # malformed responses fail the writers instead of leaving them waiting
+    with raises(KeyError):
+        await asyncio.wait_for(uplink.put_parameter(MOCK_SYSTEMID, 100, 1), 1)
+    with raises(TypeError):
+        await asyncio.wait_for(uplink.put_parameter(MOCK_SYSTEMID, 100, 1), 1)
+    assert not uplink.writers
+
+
+async def test_close_in_flight(aioresp: aioresponses, uplink: Uplink):
+    retry = RetryPolicy(jitter=lambda low, high: 60)
+    uplink = Uplink(uplink.session, throttle=0, retry=retry)
+    base = f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}"
+    connect_error = aiohttp.ClientConnectorError(Mock(), OSError(111, "refused"))
+    aioresp.get(
+        f"{base}/parameters?parameterIds=100",
+        status=503,
+        body="Unavailable",
+        content_type="text/plain",
+    )
+    aioresp.put(f"{base}/parameters", exception=connect_error)
+    aioresp.get(base, status=503, body="Unavailable", content_type="text/plain")
+
+    # every request is waiting to be retried when closing
+    parameter = asyncio.ensure_future(uplink.get_parameter(MOCK_SYSTEMID, 100))
+    write = asyncio.ensure_future(uplink.put_parameter(MOCK_SYSTEMID, 100, 1))
+    system = asyncio.ensure_future(uplink.get_system(MOCK_SYSTEMID))
+    for _ in range(10):
+        await asyncio.sleep(0)
+    assert retry.stats["retried"] == 3
+
+    await asyncio.wait_for(uplink.close(), 1)
+    assert not uplink.dispatchers
+    assert not uplink.writers
+    assert not uplink.shared
+    assert await parameter is None
+    assert await write is None
+    with raises(asyncio.CancelledError):
+        await system
+
+
+async def test_retry_budget(aioresp: aioresponses, uplink: Uplink):
+    budget = RetryBudget(ratio=0, reserve=1)
+    retry = RetryPolicy(attempts=5, budget=budget, jitter=_no_jitter)
+    uplink = Uplink(uplink.session, throttle=0, retry=retry)
+    url = f"https://api.nibeuplink.com/api/v1/systems/{MOCK_SYSTEMID}"
+    aioresp.get(url, status=500, body="Error", content_type="text/plain", repeat=True)
+
+    with raises(UplinkException):
+        await uplink.get_system(MOCK_SYSTEMID)
+    assert retry.stats == {"retried": 1, "throttled": 1}